@@ -34,8 +34,17 @@ type HttpClientHandler (server : HttpServer, peer : TcpClient) =
 
     let mutable handlers = []
 
+#if wsgi
+    let mutable wsgiconn : WsgiConnection = null
+#endif
+
     interface IDisposable with
         member self.Dispose () =
+#if wsgi
+            if wsgiconn <> null then
+                noexn (fun () -> WsgiHandler.release wsgiconn);
+            wsgiconn <- null
+#endif
             if stream <> null then
                 noexn (fun () -> rawstream.Dispose ());
             if rawstream <> null then
@@ -88,15 +97,16 @@ type HttpClientHandler (server : HttpServer, peer : TcpClient) =
 
 #if wsgi
     member private self.ServeWsgi (request : HttpRequest) =
-        HttpWSGI.WsgiHandler.entry server.Config request stream
+        if wsgiconn = null then
+            wsgiconn <- new WsgiConnection (new HttpBodyStream(reader), stream)
+        HttpWSGI.WsgiHandler.entry server.Config wsgiconn request
 
     member private self.WsgiHandler (request : HttpRequest) =
         let path   = HttpServer.CanonicalPath request.path in
         let wsgire = new Regex(@"^wsgi(:?/|$)") in
 
             if wsgire.IsMatch(path) then
-                self.ServeWsgi(request)
-                Some false (* No keep-alive *)
+                Some (self.ServeWsgi(request))
             else
                 None        
 #endif
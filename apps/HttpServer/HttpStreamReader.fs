@@ -37,6 +37,17 @@ type HttpStreamReader (stream : Stream) =
         end
         position < available
 
+    (* Reads the bytes following the request head: the ones already
+       buffered first, then the underlying stream. *)
+    member self.Read (output : byte[], offset : int, count : int) : int =
+        if position < available then
+            let n = min count (available - position) in
+                Array.blit buffer position output offset n;
+                position <- position + n;
+                n
+        else
+            stream.Read(output, offset, count)
+
     member private self.ReadLine () : string =
         let (*---*) output = StringBuilder () in
 
@@ -119,3 +130,32 @@ type HttpStreamReader (stream : Stream) =
                           headers = headers }
 
                 | _ -> raise InvalidHttpRequest
+
+(* ------------------------------------------------------------------------ *)
+(* Read-only view of a request body, see HttpStreamReader.Read *)
+type HttpBodyStream (reader : HttpStreamReader) =
+    inherit Stream ()
+
+    override self.CanRead  = true
+    override self.CanSeek  = false
+    override self.CanWrite = false
+
+    override self.Length = raise (NotSupportedException ())
+
+    override self.Position
+        with get () = raise (NotSupportedException ())
+        and  set (_ : int64) = raise (NotSupportedException ())
+
+    override self.Flush () = ()
+
+    override self.Read (buffer : byte[], offset : int, count : int) =
+        reader.Read (buffer, offset, count)
+
+    override self.Seek (_ : int64, _ : SeekOrigin) : int64 =
+        raise (NotSupportedException ())
+
+    override self.SetLength (_ : int64) =
+        raise (NotSupportedException ())
+
+    override self.Write (_ : byte[], _ : int, _ : int) =
+        raise (NotSupportedException ())
@@ -42,62 +42,140 @@ type WsgiEngine () =
             finally
                 tid <- (nativeint) 0)
 
+    (* Runs [f] without the Python lock, that the calling thread holds *)
+    static member AllowThreads (f : unit -> 'a) : 'a =
+        let state = PythonEngine.BeginAllowThreads () in
+            try f () finally PythonEngine.EndAllowThreads state
+
+// ------------------------------------------------------------------------
+// Stream given to the bridge: blocking operations release the Python
+// lock, so that the other requests can run meanwhile.
+type WsgiStream (stream : Stream) =
+    inherit Stream ()
+
+    member self.BaseStream = stream
+
+    override self.CanRead  = stream.CanRead
+    override self.CanSeek  = false
+    override self.CanWrite = stream.CanWrite
+
+    override self.Length = raise (NotSupportedException ())
+
+    override self.Position
+        with get () = raise (NotSupportedException ())
+        and  set (_ : int64) = raise (NotSupportedException ())
+
+    override self.Flush () =
+        WsgiEngine.AllowThreads (fun () -> stream.Flush ())
+
+    override self.Read (buffer : byte[], offset : int, count : int) =
+        WsgiEngine.AllowThreads (fun () -> stream.Read (buffer, offset, count))
+
+    override self.Write (buffer : byte[], offset : int, count : int) =
+        WsgiEngine.AllowThreads (fun () -> stream.Write (buffer, offset, count))
+
+    override self.Seek (_ : int64, _ : SeekOrigin) : int64 =
+        raise (NotSupportedException ())
+
+    override self.SetLength (_ : int64) =
+        raise (NotSupportedException ())
+
+// ------------------------------------------------------------------------
+// Per-connection state of the WSGI handler: the bridge streams are
+// created once and reused by all the requests of a keep-alive connection,
+// and the bridge pools its stream wrappers by connection [Id].
+[<AllowNullLiteral>]
+type WsgiConnection (input : Stream, stream : Stream) =
+    static let counter = ref 0L
+
+    let id     = System.Threading.Interlocked.Increment (counter)
+    let input  = new WsgiStream (input)
+    let output = new WsgiStream (stream)
+
+    member self.Id     = id
+    member self.Stream = stream
+    member self.Input  = input
+    member self.Output = output
+
+// ------------------------------------------------------------------------
+// Session information of a TLS stream. The bridge caches it by [Key]
+// (the session ID, or the session hash when there is none), and only
+// calls [Materialize] the first time a session is seen.
+[<AllowNullLiteral>]
+type WsgiSessionInfo (stream : TLStream.TLStream) =
+    static let cs_map = Map.ofArray (Utils.enumeration<TLSConstants.cipherSuiteName> ())
+    static let vr_map = Map.ofArray (Utils.enumeration<TLSConstants.ProtocolVersion> ())
+    static let cp_map = Map.ofArray (Utils.enumeration<TLSConstants.Compression>     ())
+
+    let sinfo = stream.GetSessionInfo ()
+
+    member self.Key =
+        if Bytes.length sinfo.sessionID <> 0
+        then "id:"   + Bytes.hexString sinfo.sessionID
+        else "hash:" + Bytes.hexString sinfo.session_hash
+
+    member self.Materialize () =
+        [ ("cipher"      , Map.find (Utils.unerror (TLSConstants.name_of_cipherSuite sinfo.cipher_suite)) cs_map :> obj);
+          ("compression" , Map.find sinfo.compression cp_map :> obj);
+          ("version"     , Map.find sinfo.protocol_version vr_map :> obj);
+          ("session-hash", Bytes.hexString sinfo.session_hash :> obj);
+          ("session-extensions", Printf.sprintf "%A" sinfo.extensions :> obj);
+        ]
+            |> Map.ofList
+
 // ------------------------------------------------------------------------
 // We currently only support one WSGI application per server
 type WsgiHandler () =
     static let mutable application = null
+    static let mutable dispatcher  = null
 
     do
         WsgiEngine.initialize ()
         use lock   = new WsgiEngineLock () in
         use appmod = PythonEngine.ImportModule ("wsgiapp") in
+        use bridge = PythonEngine.ImportModule ("wsgibridge") in
             application <- appmod.GetAttr("main").Invoke([||])
-
-    (* ------------------------------------------------------------------------ *)
-    static let cs_map = Map.ofArray (Utils.enumeration<TLSConstants.cipherSuiteName> ())
-    static let vr_map = Map.ofArray (Utils.enumeration<TLSConstants.ProtocolVersion> ())
-    static let cp_map = Map.ofArray (Utils.enumeration<TLSConstants.Compression>     ())
+            dispatcher  <- bridge.GetAttr("Dispatcher").Invoke([|application|])
 
     interface IDisposable with
         member self.Dispose () =
+            dispatcher  <- null
             application <- null
             WsgiEngine.finalize ()
 
-    static member entry (config : HttpServerConfig) (request : HttpRequest) (stream : Stream) =
+    static member entry (config : HttpServerConfig) (connection : WsgiConnection) (request : HttpRequest) =
         assert PythonEngine.IsInitialized
 
         use lock   = new WsgiEngineLock () in
-        use bridge = PythonEngine.ImportModule ("wsgibridge") in
+        let stream = connection.Stream in
         let error  = System.Console.Error in
         let url    = sprintf "https://%s/%s" config.servname request.path in
 
         let sinfo =
-            try
-                let sinfo = (stream :?> TLStream.TLStream) in
-                let sinfo = sinfo.GetSessionInfo () in
-                let sinfo =
-                    [ ("cipher"      , Map.find (Utils.unerror (TLSConstants.name_of_cipherSuite sinfo.cipher_suite)) cs_map :> obj);
-                      ("compression" , Map.find sinfo.compression cp_map :> obj);
-                      ("version"     , Map.find sinfo.protocol_version vr_map :> obj);
-                      ("session-hash", Bytes.hexString sinfo.session_hash :> obj);
-                      ("session-extensions", Printf.sprintf "%A" sinfo.extensions :> obj);
-                    ]
-                        |> Map.ofList
-                in
-                    sinfo
-            with :? InvalidCastException -> Map.empty
+            match stream with
+            | :? TLStream.TLStream as tls -> WsgiSessionInfo (tls)
+            | _ -> null
         in
 
         let config =
-            [ ("url"    , url     :> obj);
+            [ ("connection", connection.Id :> obj);
+              ("url"    , url     :> obj);
               ("request", request :> obj);
+              ("version", string_of_httpversion request.version :> obj);
               ("error"  , error   :> obj);
-              ("input"  , stream  :> obj);
-              ("output" , stream  :> obj);
+              ("input"  , connection.Input  :> obj);
+              ("output" , connection.Output :> obj);
               ("sinfo"  , sinfo   :> obj);
             ]
                 |> Map.ofList
                 |> PyObject.FromManagedObject
         in
 
-        ignore (bridge.GetAttr("_entry").Invoke([|config; application|]))
+        (* Whether the connection can be kept alive *)
+        dispatcher.Invoke([|config|]).IsTrue ()
+
+    static member release (connection : WsgiConnection) =
+        assert PythonEngine.IsInitialized
+
+        use lock = new WsgiEngineLock () in
+            ignore (dispatcher.GetAttr("release").Invoke([|new PyLong (connection.Id) :> PyObject|]))
@@ -0,0 +1,157 @@
+﻿# ------------------------------------------------------------------------
+# Tests of the application registry of wsgiapp, with a fake loader.
+#
+#   python -m unittest test_wsgiapp
+
+# ------------------------------------------------------------------------
+import os, tempfile, unittest
+import wsgiapp
+
+# ------------------------------------------------------------------------
+class Loader(object):
+    # Loads `application <n>' (a WSGI application), and records when
+    # the applications are closed
+    def __init__(self):
+        self.loaded = 0
+        self.closed = []
+
+    def __call__(self, inifile):
+        index = self.loaded
+        self.loaded += 1
+
+        def application(environ, start_response):
+            start_response('200 OK', [])
+            yield ('application %d' % (index,)).encode('ascii')
+
+        application.index = index
+        return (application, lambda : self.closed.append(index))
+
+class FileWrapper(object):
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+    def __iter__(self):
+        return iter(())
+
+# ------------------------------------------------------------------------
+class TestApplicationRegistry(unittest.TestCase):
+    def setUp(self):
+        fd, self.inifile = tempfile.mkstemp(suffix = '.ini')
+        os.close(fd)
+        self.mtime  = 1000000000
+        self.loader = Loader()
+        self.touch()
+
+    def tearDown(self):
+        os.remove(self.inifile)
+
+    def touch(self):
+        self.mtime += 10
+        os.utime(self.inifile, (self.mtime, self.mtime))
+
+    def test_loaded_once(self):
+        registry = wsgiapp.ApplicationRegistry(self.loader)
+        for _ in range(10):
+            registry.release(registry.acquire(self.inifile))
+        self.assertEqual(self.loader.loaded, 1)
+
+    def test_interval(self):
+        stats = []
+        def stat(path, _stat = os.stat):
+            stats.append(path)
+            return _stat(path)
+
+        registry = wsgiapp.ApplicationRegistry(self.loader, interval = 3600)
+        os.stat, _stat = stat, os.stat
+        try:
+            registry.release(registry.acquire(self.inifile))
+            self.touch()
+            for _ in range(10):
+                entry = registry.acquire(self.inifile)
+                registry.release(entry)
+        finally:
+            os.stat = _stat
+        self.assertEqual(stats, [self.inifile])
+        self.assertEqual(entry.application.index, 0)
+
+    def test_reload(self):
+        registry = wsgiapp.ApplicationRegistry(self.loader, interval = 0)
+        registry.release(registry.acquire(self.inifile))
+        registry.release(registry.acquire(self.inifile))
+        self.assertEqual(self.loader.loaded, 1)
+
+        self.touch()
+        entry = registry.acquire(self.inifile)
+        registry.release(entry)
+        self.assertEqual(entry.application.index, 1)
+        self.assertEqual(self.loader.closed, [0])
+
+    def test_close_deferred_to_last_request(self):
+        registry = wsgiapp.ApplicationRegistry(self.loader, interval = 0)
+        first  = registry.acquire(self.inifile)
+        second = registry.acquire(self.inifile)
+
+        self.touch()
+        registry.release(registry.acquire(self.inifile))
+        self.assertEqual(self.loader.closed, [])
+        registry.release(first)
+        self.assertEqual(self.loader.closed, [])
+        registry.release(second)
+        self.assertEqual(self.loader.closed, [0])
+
+# ------------------------------------------------------------------------
+class TestTrackedApplication(unittest.TestCase):
+    def setUp(self):
+        fd, self.inifile = tempfile.mkstemp(suffix = '.ini')
+        os.close(fd)
+        os.utime(self.inifile, (1000000000, 1000000000))
+        self.loader   = Loader()
+        self.registry = wsgiapp.registry
+        wsgiapp.registry = wsgiapp.ApplicationRegistry(self.loader, interval = 0)
+
+    def tearDown(self):
+        wsgiapp.registry = self.registry
+        os.remove(self.inifile)
+
+    def test_close_deferred_to_result_close(self):
+        application = wsgiapp.miTLSApplication.create(self.inifile)
+        result = application(dict(), lambda status, headers : None)
+
+        os.utime(self.inifile, (1000000010, 1000000010))
+        self.assertEqual(list(application(dict(), lambda status, headers : None)),
+                         [b'application 1'])
+        self.assertEqual(self.loader.closed, [])
+        self.assertEqual(list(result), [b'application 0'])
+        result.close()
+        result.close()
+        self.assertEqual(self.loader.closed, [0])
+
+    def test_file_wrapper_kept(self):
+        wrapper = FileWrapper()
+        environ = {'wsgi.file_wrapper': FileWrapper}
+        released = []
+        result = wsgiapp.TrackedResult.wrap(environ, wrapper, lambda : released.append(1))
+        self.assertTrue(result is wrapper)
+        result.close()
+        self.assertTrue(wrapper.closed)
+        self.assertEqual(released, [1])
+
+    def test_failing_application_released(self):
+        def loader(inifile):
+            def application(environ, start_response):
+                raise RuntimeError(inifile)
+            return (application, lambda : self.loader.closed.append(inifile))
+        wsgiapp.registry = wsgiapp.ApplicationRegistry(loader, interval = 0)
+
+        application = wsgiapp.miTLSApplication.create(self.inifile)
+        self.assertRaises(RuntimeError, application, dict(), None)
+        os.utime(self.inifile, (1000000010, 1000000010))
+        self.assertRaises(RuntimeError, application, dict(), None)
+        self.assertEqual(self.loader.closed, [self.inifile])
+
+# ------------------------------------------------------------------------
+if __name__ == '__main__':
+    unittest.main()
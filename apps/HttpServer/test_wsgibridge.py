@@ -0,0 +1,561 @@
+﻿# ------------------------------------------------------------------------
+# Tests of wsgibridge, run outside of HttpServer:
+# the few .NET types the bridge uses are replaced by in-memory ones.
+#
+#   python -m unittest test_wsgibridge
+
+# ------------------------------------------------------------------------
+import sys, os, io, types, ctypes, numbers, tempfile, unittest
+
+# ------------------------------------------------------------------------
+def _dotnet():
+    class Stream(object):
+        def __init__(self, data):
+            self.input    = io.BytesIO(data)
+            self.output   = io.BytesIO()
+            self.writes   = []
+            self.CanRead  = True
+            self.CanWrite = True
+
+        def Read(self, block, offset, count):
+            data = self.input.read(count)
+            block[offset:offset+len(data)] = data
+            return len(data)
+
+        def Write(self, block, offset, count):
+            self.output.write(bytes(block[offset:offset+count]))
+            self.writes.append(count)
+
+        def Flush(self):
+            pass
+
+    class Marshal(object):
+        @staticmethod
+        def Copy(*args):
+            if isinstance(args[0], numbers.Integral):   # (IntPtr, byte[], int, int)
+                address, block, offset, count = args
+                block[offset:offset+count] = ctypes.string_at(address, count)
+            else:                                       # (byte[], int, IntPtr, int)
+                block, offset, address, count = args
+                ctypes.memmove(address, bytes(block[offset:offset+count]), count)
+
+    dotnet = types.ModuleType('System')
+    class IO(object):
+        pass
+
+    class Array(object):
+        @staticmethod
+        def CreateInstance(kind, size):
+            return bytearray(size)
+
+    IO.Stream, IO.TextWriter = Stream, object
+
+    dotnet.IO     = IO
+    dotnet.Array  = Array
+    dotnet.Byte   = 'Byte'
+    dotnet.IntPtr = lambda address : address
+
+    interop = types.ModuleType('System.Runtime.InteropServices')
+    interop.Marshal = Marshal
+
+    return dotnet, interop
+
+if 'System' not in sys.modules:
+    _system, _interop = _dotnet()
+    sys.modules['System'] = _system
+    sys.modules['System.Runtime'] = types.ModuleType('System.Runtime')
+    sys.modules['System.Runtime.InteropServices'] = _interop
+
+import wsgibridge, wsgistats
+
+# ------------------------------------------------------------------------
+class Headers(object):
+    def __init__(self, headers):
+        self._headers = dict([(k.lower(), v) for k, v in headers.items()])
+
+    def GetDfl(self, key, dfl):
+        return self._headers.get(key.lower(), dfl)
+
+class Request(object):
+    def __init__(self, method, headers):
+        self.mthod   = method
+        self.headers = Headers(headers)
+
+# ------------------------------------------------------------------------
+def _stream(data, chunk = None):
+    # An in-memory stream, that reads at most [chunk] bytes at once
+    stream = sys.modules['System'].IO.Stream(data)
+    if chunk is not None:
+        read = stream.Read
+        stream.Read = lambda block, offset, count : read(block, offset, min(count, chunk))
+    return stream
+
+# ------------------------------------------------------------------------
+class TestInputStream(unittest.TestCase):
+    BLOCKSIZE = wsgibridge.WSGIInputStream.BLOCKSIZE
+
+    # All byte values, line ends included, over more than 2 blocks
+    BODY = bytearray(range(256)) * (2 * BLOCKSIZE // 256 + 3)
+    BODY = bytes(BODY)
+
+    def _input(self, data, length, chunk = None):
+        stream = _stream(data, chunk)
+        aout   = wsgibridge.WSGIInputStream(stream)
+        aout.reset(length)
+        return aout, stream
+
+    def test_read_blocks(self):
+        for chunk in (None, 1000):
+            rfile, stream = self._input(self.BODY + b'GET /', len(self.BODY), chunk)
+            size = self.BLOCKSIZE + 100
+            self.assertEqual(rfile.read(size), self.BODY[:size])
+            self.assertEqual(rfile.read(size), self.BODY[size:2*size])
+            self.assertEqual(rfile.read(), self.BODY[2*size:])
+            self.assertEqual(rfile.read(), b'')
+            self.assertEqual(rfile.read(10), b'')
+            self.assertEqual(rfile.remaining, 0)
+            self.assertEqual(stream.input.read(), b'GET /')
+
+    def test_read_at_limit(self):
+        rfile, stream = self._input(b'helloGET /', 5)
+        self.assertEqual(rfile.read(3), b'hel')
+        self.assertEqual(rfile.read(10), b'lo')
+        self.assertEqual(rfile.read(10), b'')
+        self.assertEqual(stream.input.read(), b'GET /')
+
+    def test_readline(self):
+        line = b'a' * (self.BLOCKSIZE + 10) + b'\n'
+        body = line + b'short\r\n' + b'\x00\xff\rbin\n' + b'tail'
+        for chunk in (None, 1000):
+            rfile, stream = self._input(body + b'GET /', len(body), chunk)
+            self.assertEqual(rfile.readline(), line)
+            self.assertEqual(rfile.readline(3), b'sho')
+            self.assertEqual(rfile.readline(), b'rt\r\n')
+            self.assertEqual(rfile.read(4), b'\x00\xff\rb')
+            self.assertEqual(rfile.readline(None), b'in\n')
+            self.assertEqual(rfile.readline(), b'tail')
+            self.assertEqual(rfile.readline(), b'')
+            self.assertEqual(stream.input.read(), b'GET /')
+
+    def test_readline_then_read(self):
+        body = b'first\n' + self.BODY
+        rfile, _ = self._input(body, len(body))
+        self.assertEqual(rfile.readline(), b'first\n')
+        self.assertEqual(rfile.read(), self.BODY)
+
+    def test_iter(self):
+        body = b'a\nb\r\n\nc'
+        rfile, _ = self._input(body, len(body))
+        self.assertEqual(list(rfile), [b'a\n', b'b\r\n', b'\n', b'c'])
+
+    def test_keep_alive(self):
+        # The unread part of a body is skipped, and the buffers are not
+        # carried over to the next request of the connection
+        first = b'line\n' + self.BODY
+        rfile, stream = self._input(first + b'12345' + b'rest', len(first))
+        self.assertEqual(rfile.readline(), b'line\n')
+        self.assertEqual(rfile.read(10), self.BODY[:10])
+        rfile.discard()
+        self.assertEqual(rfile.remaining, 0)
+
+        rfile.reset(5)
+        self.assertEqual(rfile.readline(), b'12345')
+        self.assertEqual(rfile.read(), b'')
+        rfile.discard()
+        self.assertEqual(stream.input.read(), b'rest')
+
+    def test_empty_body(self):
+        rfile, stream = self._input(b'GET /', 0)
+        self.assertEqual(rfile.read(), b'')
+        self.assertEqual(rfile.readline(), b'')
+        rfile.discard()
+        self.assertEqual(stream.input.read(), b'GET /')
+
+# ------------------------------------------------------------------------
+class TestOutputStream(unittest.TestCase):
+    BLOCKSIZE = wsgibridge.WSGIOutputStream.BLOCKSIZE
+
+    def test_coalescing(self):
+        stream = _stream(b'')
+        output = wsgibridge.WSGIOutputStream(stream)
+        data   = bytes(bytearray(range(256))) * 10
+
+        for _ in range(7):              # 17920 bytes
+            output.write(data)
+        self.assertEqual(stream.writes, [self.BLOCKSIZE])
+        output.write(data * 14)         # 35840 bytes
+        self.assertEqual(stream.writes, [self.BLOCKSIZE] * 3)
+        output.flush()
+        self.assertEqual(stream.writes, [self.BLOCKSIZE] * 3 + [53760 - 3 * self.BLOCKSIZE])
+        self.assertEqual(stream.output.getvalue(), data * 21)
+
+    def test_flush(self):
+        stream = _stream(b'')
+        output = wsgibridge.WSGIOutputStream(stream)
+        output.flush()
+        self.assertEqual(stream.writes, [])
+        output.write(b'ab')
+        output.write(u'c\xe9')
+        self.assertEqual(stream.writes, [])
+        output.flush()
+        output.flush()
+        self.assertEqual(stream.writes, [4])
+        self.assertEqual(stream.output.getvalue(), b'abc\xe9')
+
+# ------------------------------------------------------------------------
+class TestRequestFraming(unittest.TestCase):
+    def _serve(self, headers, body):
+        stream = sys.modules['System'].IO.Stream(body)
+        seen   = []
+
+        def application(environ, start_response):
+            seen.append(environ['wsgi.input'].read())
+            start_response('200 OK', [('Content-Length', '2')])
+            return [b'ok']
+
+        config = dict(url = 'https://localhost/wsgi/', version = '1.1',
+                      request = Request('POST', headers), sinfo = None,
+                      input = stream, output = stream, error = None)
+        streams = (wsgibridge.WSGIInputStream(stream),
+                   wsgibridge.WSGIOutputStream(stream), None)
+        persist = wsgibridge.Bridge(config, streams)(application)
+        return persist, seen[0], stream.input.read()
+
+    def test_content_length(self):
+        persist, body, rest = self._serve({'Content-Length': '5'}, b'helloGET /')
+        self.assertTrue(persist)
+        self.assertEqual(body, b'hello')
+        self.assertEqual(rest, b'GET /')
+
+    def test_chunked_request_closes_connection(self):
+        persist, body, _ = self._serve(
+            {'Transfer-Encoding': 'chunked'}, b'5\r\nhello\r\n0\r\n\r\n')
+        self.assertFalse(persist)
+        self.assertEqual(body, b'')
+
+    def test_invalid_content_length_closes_connection(self):
+        for length in ('abc', '-5', '5, 5', ''):
+            persist, body, _ = self._serve({'Content-Length': length}, b'hello')
+            self.assertFalse(persist, length)
+            self.assertEqual(body, b'')
+
+# ------------------------------------------------------------------------
+def _serve(application, method = 'GET', version = '1.1', headers = {}):
+    # Serve one request with [application]: returns whether the
+    # connection can be kept alive, and the stream
+    stream = _stream(b'')
+    config = dict(url = 'https://localhost/wsgi/', version = version,
+                  request = Request(method, headers), sinfo = None,
+                  input = stream, output = stream, error = None)
+    streams = (wsgibridge.WSGIInputStream(stream),
+               wsgibridge.WSGIOutputStream(stream), None)
+    return wsgibridge.Bridge(config, streams)(application), stream
+
+def _response(stream):
+    # The status line, headers and body written to [stream]
+    head, body = stream.output.getvalue().split(b'\r\n\r\n', 1)
+    head = head.decode('iso-8859-1').split('\r\n')
+    return head[0], head[1:], body
+
+# ------------------------------------------------------------------------
+class TestResponseFraming(unittest.TestCase):
+    @staticmethod
+    def application(headers, blocks):
+        def application(environ, start_response):
+            start_response('200 OK', headers)
+            return iter(blocks)
+        return application
+
+    def test_chunked(self):
+        persist, stream = _serve(self.application([], [b'abc', b'', b'x' * 300]))
+        status, headers, body = _response(stream)
+        self.assertTrue(persist)
+        self.assertEqual(status, 'HTTP/1.1 200 OK')
+        self.assertEqual(headers, ['Transfer-Encoding: chunked'])
+        self.assertEqual(body, b'3\r\nabc\r\n12c\r\n' + b'x' * 300 + b'\r\n0\r\n\r\n')
+
+    def test_chunked_empty(self):
+        persist, stream = _serve(self.application([], []))
+        self.assertTrue(persist)
+        self.assertEqual(_response(stream)[2], b'0\r\n\r\n')
+
+    def test_chunked_close(self):
+        persist, stream = _serve(self.application([], [b'abc']),
+                                 headers = {'Connection': 'close'})
+        status, headers, body = _response(stream)
+        self.assertFalse(persist)
+        self.assertEqual(headers, ['Transfer-Encoding: chunked', 'Connection: close'])
+        self.assertEqual(body, b'3\r\nabc\r\n0\r\n\r\n')
+
+    def test_content_length(self):
+        persist, stream = _serve(self.application([('Content-Length', '3')], [b'abc']))
+        self.assertTrue(persist)
+        self.assertEqual(_response(stream)[1:], (['Content-Length: 3'], b'abc'))
+
+    def test_http10(self):
+        # No chunked encoding in HTTP/1.0: the end of the body is the
+        # end of the connection
+        persist, stream = _serve(self.application([], [b'abc']), version = '1.0')
+        status, headers, body = _response(stream)
+        self.assertFalse(persist)
+        self.assertEqual((status, headers, body), ('HTTP/1.0 200 OK', [], b'abc'))
+
+    def test_head(self):
+        persist, stream = _serve(self.application([], [b'abc']), method = 'HEAD')
+        self.assertTrue(persist)
+        self.assertEqual(_response(stream)[1:], ([], b''))
+
+# ------------------------------------------------------------------------
+class TestEnviron(unittest.TestCase):
+    def test_isolation(self):
+        base     = dict(wsgibridge.base_environ('https'))
+        environs = []
+
+        def application(environ, start_response):
+            environs.append(dict(environ))
+            environ['wsgi.url_scheme'] = 'http'
+            environ['mitls.test'] = True
+            del environ['wsgi.version']
+            start_response('200 OK', [('Content-Length', '0')])
+            return []
+
+        _serve(application)
+        _serve(application)
+        self.assertTrue(wsgibridge.base_environ('https') is wsgibridge.base_environ('https'))
+        self.assertEqual(wsgibridge.base_environ('https'), base)
+        self.assertEqual(environs[1]['wsgi.url_scheme'], 'https')
+        self.assertEqual(environs[1]['wsgi.version'], (1, 0))
+        self.assertFalse('mitls.test' in environs[1])
+
+    def test_request(self):
+        environs = []
+
+        def application(environ, start_response):
+            environs.append(environ)
+            start_response('200 OK', [('Content-Length', '0')])
+            return []
+
+        _serve(application, method = 'POST',
+               headers = {'Content-Type': 'text/plain', 'Content-Length': '0'})
+        environ, = environs
+        self.assertTrue(type(environ) is dict)
+        self.assertEqual(environ['wsgi.url_scheme'], 'https')
+        self.assertEqual(environ['HTTPS'], '1')
+        self.assertEqual(environ['REQUEST_METHOD'], 'POST')
+        self.assertEqual(environ['CONTENT_TYPE'], 'text/plain')
+        self.assertEqual(str(environ['SERVER_PORT']), '443')
+        self.assertEqual(environ['SERVER_PROTOCOL'], 'HTTP/1.1')
+        self.assertTrue(environ['wsgi.file_wrapper'] is wsgibridge.FileWrapper)
+
+# ------------------------------------------------------------------------
+class KeyValue(object):
+    def __init__(self, key, value):
+        self.Key   = key
+        self.Value = value
+
+class Session(object):
+    # Stand-in for HttpWSGI.WsgiSessionInfo
+    def __init__(self, key, **items):
+        self.Key          = key
+        self.items        = items
+        self.materialized = 0
+
+    def Materialize(self):
+        self.materialized += 1
+        return [KeyValue(k, v) for k, v in self.items.items()]
+
+class TestSessionInfo(unittest.TestCase):
+    def test_cache_bound(self):
+        cache = wsgibridge.SessionCache(size = 2)
+        a = cache.get(Session('a'))
+        b = cache.get(Session('b'))
+        self.assertTrue(cache.get(Session('a')) is a)
+        c = cache.get(Session('c'))               # evicts b, the least recent
+        self.assertTrue(cache.get(Session('a')) is a)
+        self.assertTrue(cache.get(Session('c')) is c)
+        self.assertFalse(cache.get(Session('b')) is b)
+        self.assertFalse(cache.get(Session('a')) is a)
+
+    def test_no_session(self):
+        cache = wsgibridge.SessionCache()
+        self.assertTrue(cache.get(None) is wsgibridge.SessionCache.EMPTY)
+        self.assertEqual(dict(cache.get(None)), {})
+
+    def test_mapping(self):
+        source = Session('a', cipher = 'TLS_AES_128_GCM_SHA256', version = 'TLS_1p3')
+        sinfo  = wsgibridge.SessionCache().get(source)
+        self.assertEqual(source.materialized, 0)
+        self.assertEqual(sinfo['cipher'], 'TLS_AES_128_GCM_SHA256')
+        self.assertEqual(sorted(sinfo), ['cipher', 'version'])
+        self.assertEqual(len(sinfo), 2)
+        self.assertEqual(sinfo.get('sni', None), None)
+        self.assertEqual(source.materialized, 1)
+
+    def test_read_only(self):
+        sinfo = wsgibridge.SessionCache().get(Session('a', cipher = 'x'))
+        def assign():
+            sinfo['cipher'] = 'y'
+        def delete():
+            del sinfo['cipher']
+        self.assertRaises(TypeError, assign)
+        self.assertRaises(TypeError, delete)
+        self.assertFalse(hasattr(sinfo, 'update'))
+        self.assertEqual(dict(sinfo), dict(cipher = 'x'))
+
+# ------------------------------------------------------------------------
+class TestFileWrapper(unittest.TestCase):
+    LARGEBLOCK = wsgibridge.WSGIOutputStream.LARGEBLOCK
+    DATA       = bytes(bytearray(range(256))) * (LARGEBLOCK // 256 + 100)
+
+    def setUp(self):
+        self.files = []
+
+    def tearDown(self):
+        for stream in self.files:
+            stream.close()
+
+    def _file(self, data, offset = 0):
+        stream = tempfile.TemporaryFile()
+        stream.write(data)
+        stream.seek(offset)
+        self.files.append(stream)
+        return stream
+
+    @staticmethod
+    def application(filelike, length = None):
+        def application(environ, start_response):
+            headers = [] if length is None else [('Content-Length', str(length))]
+            start_response('200 OK', headers)
+            return environ['wsgi.file_wrapper'](filelike)
+        return application
+
+    def test_sendfile(self):
+        stream = self._file(self.DATA)
+        persist, output = _serve(self.application(stream, len(self.DATA)))
+        self.assertTrue(persist)
+        self.assertEqual(_response(output)[2], self.DATA)
+        # The headers, then the file by large blocks
+        self.assertEqual(output.writes[1:], [self.LARGEBLOCK, len(self.DATA) - self.LARGEBLOCK])
+        self.assertTrue(stream.closed)
+
+    def test_sendfile_offset(self):
+        stream = self._file(self.DATA, 1000)
+        persist, output = _serve(self.application(stream, len(self.DATA) - 1000))
+        self.assertEqual(_response(output)[2], self.DATA[1000:])
+
+    def test_sendfile_chunked(self):
+        stream = self._file(b'hello world', 6)
+        persist, output = _serve(self.application(stream))
+        self.assertTrue(persist)
+        self.assertEqual(_response(output)[2], b'5\r\nworld\r\n0\r\n\r\n')
+
+    def test_sendfile_head(self):
+        stream = self._file(self.DATA)
+        persist, output = _serve(self.application(stream, len(self.DATA)), method = 'HEAD')
+        self.assertEqual(_response(output)[2], b'')
+        self.assertEqual(len(output.writes), 1)
+
+    def test_fallback(self):
+        # Files that cannot be mapped (empty, or read to their end) and
+        # file-likes without a file are iterated
+        for filelike in (self._file(b''), self._file(b'hello', 5)):
+            persist, output = _serve(self.application(filelike))
+            self.assertTrue(persist)
+            self.assertEqual(_response(output)[2], b'0\r\n\r\n')
+            self.assertTrue(filelike.closed)
+
+        filelike = io.BytesIO(self.DATA)
+        persist, output = _serve(self.application(filelike, len(self.DATA)))
+        self.assertEqual(_response(output)[2], self.DATA)
+        self.assertTrue(filelike.closed)
+
+    def test_wrapper(self):
+        stream  = self._file(b'hello world', 6)
+        wrapper = wsgibridge.FileWrapper(stream, 2)
+        self.assertEqual(wrapper.fileno(), stream.fileno())
+        self.assertEqual(wrapper.tell(), 6)
+        self.assertEqual(list(wrapper), [b'wo', b'rl', b'd'])
+        self.assertEqual(wsgibridge.FileWrapper(io.BytesIO(b'')).fileno(), None)
+
+# ------------------------------------------------------------------------
+class TestStreaming(unittest.TestCase):
+    def _serve(self, application):
+        return _serve(application)[1]
+
+    def test_blocks_sent_before_next(self):
+        sent = []
+
+        def application(environ, start_response):
+            start_response('200 OK', [('Content-Length', '6')])
+            for data in (b'ab', b'cd', b'ef'):
+                sent.append(environ['wsgi.input'].basestream.output.getvalue())
+                yield data
+
+        stream = self._serve(application)
+        self.assertEqual(sent[0], b'')
+        self.assertTrue(sent[1].endswith(b'\r\n\r\nab'))
+        self.assertTrue(sent[2].endswith(b'\r\n\r\nabcd'))
+        self.assertTrue(stream.output.getvalue().endswith(b'\r\n\r\nabcdef'))
+
+    def test_list_sent_as_one(self):
+        def application(environ, start_response):
+            start_response('200 OK', [('Content-Length', '6')])
+            return [b'ab', b'cd', b'ef']
+
+        stream = self._serve(application)
+        self.assertEqual(len(stream.writes), 1)
+        self.assertTrue(stream.output.getvalue().endswith(b'\r\n\r\nabcdef'))
+
+# ------------------------------------------------------------------------
+class RecordingSink(wsgistats.HistogramSink):
+    def __init__(self):
+        wsgistats.HistogramSink.__init__(self)
+        self.recorded = []
+
+    def record(self, timings):
+        self.recorded.append(timings)
+        wsgistats.HistogramSink.record(self, timings)
+
+class TestDispatcherTimings(unittest.TestCase):
+    def setUp(self):
+        self.sink       = RecordingSink()
+        self.dispatcher = wsgibridge.Dispatcher(self.application, [self.sink])
+
+    @staticmethod
+    def application(environ, start_response):
+        start_response('200 OK', [])
+        yield b'hello '
+        yield b'world'
+
+    def _request(self, path):
+        # One connection per request: the dispatcher pools the streams
+        stream = sys.modules['System'].IO.Stream(b'')
+        config = dict(connection = stream, url = 'https://localhost' + path, version = '1.1',
+                      request = Request('GET', {}), sinfo = None,
+                      input = stream, output = stream, error = None)
+        return self.dispatcher(config), stream.output.getvalue()
+
+    def test_timings(self):
+        persist, output = self._request('/wsgi/x')
+        self.assertTrue(persist)
+        self.assertTrue(output.endswith(b'6\r\nhello \r\n5\r\nworld\r\n0\r\n\r\n'))
+
+        timings, = self.sink.recorded
+        self.assertEqual((timings.method, timings.path, timings.status),
+                         ('GET', '/wsgi/x', '200 OK'))
+        self.assertTrue(0 <= timings.environ <= timings.first_output <= timings.total)
+        self.assertEqual(timings.bytes, 11)
+        self.assertEqual(timings.flushes, 3)
+
+    def test_stats_path(self):
+        self._request('/wsgi/x')
+        persist, output = self._request(wsgistats.STATS_PATH)
+        self.assertTrue(persist)
+        head, body = output.split(b'\r\n\r\n', 1)
+        self.assertTrue(b'\r\nContent-Type: text/plain\r\n' in head)
+        self.assertTrue(body.startswith(b'requests 1\nstatus 200 1\n'))
+        self.assertEqual([x.path for x in self.sink.recorded], ['/wsgi/x', wsgistats.STATS_PATH])
+
+# ------------------------------------------------------------------------
+if __name__ == '__main__':
+    unittest.main()
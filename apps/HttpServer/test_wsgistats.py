@@ -0,0 +1,101 @@
+﻿# ------------------------------------------------------------------------
+# Tests of the timings sinks of the WSGI bridge.
+#
+#   python -m unittest test_wsgistats
+
+# ------------------------------------------------------------------------
+import os, unittest
+import wsgistats
+
+# ------------------------------------------------------------------------
+def timings(status, environ, first_output, total, nbytes, flushes):
+    aout = wsgistats.Timings('GET', '/wsgi/')
+    aout.status       = status
+    aout.environ      = environ
+    aout.first_output = first_output
+    aout.total        = total
+    aout.bytes        = nbytes
+    aout.flushes      = flushes
+    return aout
+
+class Stream(object):
+    def __init__(self):
+        self.lines = []
+
+    def write(self, data):
+        self.lines.append(data)
+
+    def flush(self):
+        pass
+
+# ------------------------------------------------------------------------
+class TestFromEnviron(unittest.TestCase):
+    def test_names(self):
+        sinks = wsgistats.from_environ(' Log, histogram ,')
+        self.assertEqual([type(x) for x in sinks],
+                         [wsgistats.LogSink, wsgistats.HistogramSink])
+        self.assertEqual(wsgistats.from_environ(''), [])
+
+    def test_unknown(self):
+        self.assertRaises(ValueError, wsgistats.from_environ, 'log,statsd')
+
+    def test_environ(self):
+        saved = os.environ.pop('MITLS_WSGI_STATS', None)
+        try:
+            self.assertEqual(wsgistats.from_environ(), [])
+            os.environ['MITLS_WSGI_STATS'] = 'histogram'
+            self.assertEqual([type(x) for x in wsgistats.from_environ()],
+                             [wsgistats.HistogramSink])
+        finally:
+            os.environ.pop('MITLS_WSGI_STATS', None)
+            if saved is not None:
+                os.environ['MITLS_WSGI_STATS'] = saved
+
+# ------------------------------------------------------------------------
+class TestSinks(unittest.TestCase):
+    def test_summary(self):
+        summary = wsgistats.HistogramSink._summary(list(range(100, 0, -1)))
+        self.assertEqual(summary, dict(count = 100, mean = 50.5, max = 100,
+                                       p50 = 50, p90 = 90, p99 = 99))
+        self.assertEqual(wsgistats.HistogramSink._summary([7]),
+                         dict(count = 1, mean = 7, max = 7, p50 = 7, p90 = 7, p99 = 7))
+        self.assertEqual(wsgistats.HistogramSink._summary([]), dict(count = 0))
+
+    def test_window(self):
+        sink = wsgistats.HistogramSink(size = 2)
+        for n in (1, 2, 3):
+            sink.record(timings('200 OK', n, n, n, n, n))
+        summary = sink.summary()
+        self.assertEqual(summary['requests'], 3)
+        self.assertEqual(summary['phases']['bytes']['count'], 2)
+        self.assertEqual(summary['phases']['bytes']['max'], 3)
+
+    def test_render(self):
+        sink = wsgistats.HistogramSink()
+        sink.record(timings('200 OK', 10, 20, 30, 100, 1))
+        sink.record(timings('404 Not Found', 30, 40, 50, 300, 3))
+        sink.record(timings(None, 20, None, None, 0, 0))
+        self.assertEqual(sink.render(), '\n'.join([
+            'requests 3',
+            'status 200 1',
+            'status 404 1',
+            'status error 1',
+            'environ count=3 mean=20us p50=20us p90=30us p99=30us max=30us',
+            'first_output count=2 mean=30us p50=20us p90=40us p99=40us max=40us',
+            'total count=2 mean=40us p50=30us p90=50us p99=50us max=50us',
+            'bytes count=3 mean=133 p50=100 p90=300 p99=300 max=300',
+            'flushes count=3 mean=1 p50=1 p90=3 p99=3 max=3',
+        ]) + '\n')
+
+    def test_log(self):
+        stream = Stream()
+        wsgistats.LogSink(stream).record(timings('200 OK', 10, 20, 30, 100, 1))
+        wsgistats.LogSink(stream).record(timings(None, 10, None, None, 0, 0))
+        self.assertEqual(stream.lines, [
+            'GET /wsgi/ 200 environ=10us first_output=20us total=30us bytes=100 flushes=1\n',
+            'GET /wsgi/ - environ=10us first_output=- total=- bytes=0 flushes=0\n',
+        ])
+
+# ------------------------------------------------------------------------
+if __name__ == '__main__':
+    unittest.main()
@@ -1,4 +1,108 @@
 ﻿# ------------------------------------------------------------------------
+import os, time, threading
+
+# ------------------------------------------------------------------------
+INIFILE = '/opt/mitls/bridge/development.ini'
+
+# ------------------------------------------------------------------------
+class ApplicationRegistry(object):
+    # Process-wide cache of the applications loaded from ini files: an
+    # ini file is loaded once, on first use, and reloaded when its mtime
+    # changes. The mtime is checked at most once per [interval] seconds.
+    #
+    # [loader] returns an (application, closer) pair. Requests hold the
+    # entry of their application from acquire() to release(): when an
+    # application is replaced, its closer (if not None) is called once
+    # the last of its requests is released, on the thread of that
+    # request. A closer must then not depend on the calling thread.
+
+    class Entry(object):
+        __slots__ = ('mtime', 'checked', 'application', 'closer', 'inflight', 'retired')
+
+        def __init__(self, mtime, checked, application, closer):
+            self.mtime       = mtime
+            self.checked     = checked
+            self.application = application
+            self.closer      = closer
+            self.inflight    = 0
+            self.retired     = False
+
+    def __init__(self, loader, interval = 1.0):
+        self._loader   = loader
+        self._interval = interval
+        self._lock     = threading.Lock()
+        self._apps     = dict()   # inifile (absolute) -> Entry
+
+    def acquire(self, inifile):
+        # The entry of [inifile], in use until released
+        now, retired = time.time(), None
+
+        with self._lock:
+            entry = self._apps.get(inifile, None)
+            if entry is None or now - entry.checked >= self._interval:
+                mtime = os.stat(inifile).st_mtime
+                if entry is not None and entry.mtime == mtime:
+                    entry.checked = now
+                else:
+                    application, closer = self._loader(inifile)
+                    if entry is not None:
+                        entry.retired = True
+                        if entry.inflight == 0:
+                            retired = entry
+                    entry = self.Entry(mtime, now, application, closer)
+                    self._apps[inifile] = entry
+            entry.inflight += 1
+
+        if retired is not None:
+            self._close(retired)
+        return entry
+
+    def release(self, entry):
+        with self._lock:
+            entry.inflight -= 1
+            retired = entry.retired and entry.inflight == 0
+        if retired:
+            self._close(entry)
+
+    def _close(self, entry):
+        if entry.closer is not None:
+            entry.closer()
+
+# ------------------------------------------------------------------------
+class TrackedResult(object):
+    # The result of an application, calling [release] once closed by
+    # the server (at most once)
+
+    def __init__(self, result, release):
+        self._result  = result
+        self._close   = getattr(result, 'close', None)
+        self._release = release
+
+    def __iter__(self):
+        return iter(self._result)
+
+    def close(self):
+        release, self._release = self._release, None
+        try:
+            if self._close is not None:
+                self._close()
+        finally:
+            if release is not None:
+                release()
+
+    @classmethod
+    def wrap(cls, environ, result, release):
+        # Instances of wsgi.file_wrapper are returned as is, so that the
+        # server still recognizes them (see wsgibridge.Bridge.sendfile):
+        # their close() is replaced instead.
+        tracked = cls(result, release)
+        wrapper = environ.get('wsgi.file_wrapper', None)
+        if isinstance(wrapper, type) and isinstance(result, wrapper):
+            result.close = tracked.close
+            return result
+        return tracked
+
+# ------------------------------------------------------------------------
 class BaseApplication(object):
     @staticmethod
     def create():
@@ -10,13 +114,35 @@ class BaseApplication(object):
 # ------------------------------------------------------------------------
 class miTLSApplication(object):
     @staticmethod
-    def create():
-        import sys, os, mitls, pyramid.paster as paster
+    def load(inifile):
+        # bootstrap() pushes the application registry on the pyramid
+        # threadlocal stack of the calling thread, and [closer] pops it:
+        # this is done right away, on this thread, as the router pushes
+        # its own for each request. Nothing is left to close on reload.
+        import mitls, pyramid.paster as paster
+        env = paster.bootstrap(inifile)
+        env['closer']()
+        return (env['app'], None)
+
+    @staticmethod
+    def create(inifile = None):
+        # The ini file defaults to $MITLS_WSGI_INI, then INIFILE
+        if inifile is None:
+            inifile = os.environ.get('MITLS_WSGI_INI', INIFILE)
+        inifile = os.path.abspath(inifile)
 
-        inifile = '/opt/mitls/bridge/development.ini'
-        env     = paster.bootstrap(inifile)
+        def application(environ, start_response):
+            entry = registry.acquire(inifile)
+            try:
+                result = entry.application(environ, start_response)
+            except:
+                registry.release(entry)
+                raise
+            return TrackedResult.wrap(environ, result, lambda : registry.release(entry))
+        return application
 
-        return env['app']
+# ------------------------------------------------------------------------
+registry = ApplicationRegistry(miTLSApplication.load)
 
 # ------------------------------------------------------------------------
 main = miTLSApplication.create
@@ -1,6 +1,19 @@
 ﻿# ------------------------------------------------------------------------
-import sys, os, socket, urlparse
+import sys, os, stat, mmap, socket, ctypes, threading, collections
 import System as DotNet
+from System.Runtime.InteropServices import Marshal
+import wsgistats
+
+# The bridge runs on Python 2 and 3
+try:
+    import urlparse
+except ImportError:
+    import urllib.parse as urlparse
+
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
 
 # ------------------------------------------------------------------------
 __all__ = []
@@ -12,6 +25,127 @@ def iterfun(f, pred):
         if pred(x): yield x
         else: break
 
+# ------------------------------------------------------------------------
+def _bytes(data):
+    # Wire representation of [data] (text is sent as iso-8859-1)
+    if isinstance(data, bytes):
+        return data
+    return data.encode('iso-8859-1')
+
+# ------------------------------------------------------------------------
+_environs = dict()
+_ports    = dict(http = 80, https = 443)
+
+def base_environ(scheme):
+    # The request-independent part of the WSGI environ (the process
+    # environment included), computed once per URL scheme. Requests get
+    # a copy of it (WSGI requires a builtin dict), that they overlay.
+    environ = _environs.get(scheme, None)
+    if environ is None:
+        environ = dict(os.environ.items())
+        environ['wsgi.version']       = (1, 0)
+        environ['wsgi.multithreaded'] = True
+        environ['wsgi.multiprocess' ] = False
+        environ['wsgi.run_once'     ] = False
+        environ['wsgi.url_scheme'   ] = scheme
+        environ['wsgi.file_wrapper' ] = FileWrapper
+        environ['HTTPS']              = '1' if scheme == 'https' else '0'
+        _environs[scheme] = environ
+    return environ
+
+def server_port(scheme):
+    # Memoized: getservbyname() may go through NSS
+    port = _ports.get(scheme, None)
+    if port is None:
+        port = _ports[scheme] = socket.getservbyname(scheme, 'tcp')
+    return port
+
+# ------------------------------------------------------------------------
+class FileWrapper(object):
+    # wsgi.file_wrapper. When the file is a regular one, the bridge sends
+    # it from a memory mapping (see Bridge.sendfile). Otherwise, it is
+    # iterated like any other result, by blocks of [blksize] bytes.
+
+    BLOCKSIZE = 256 * 1024
+
+    def __init__(self, filelike, blksize = BLOCKSIZE):
+        self.filelike = filelike
+        self.blksize  = blksize
+        if hasattr(filelike, 'close'):
+            self.close = filelike.close
+
+    def fileno(self):
+        # None if [filelike] is not backed by a regular file
+        try:
+            fd = self.filelike.fileno()
+            if stat.S_ISREG(os.fstat(fd).st_mode):
+                return fd
+        except (AttributeError, EnvironmentError, ValueError):
+            pass
+        return None
+
+    def tell(self):
+        try:
+            return self.filelike.tell()
+        except (AttributeError, EnvironmentError, ValueError):
+            return 0
+
+    def __iter__(self):
+        return iterfun(lambda : self.filelike.read(self.blksize), lambda x : len(x) != 0)
+
+# ------------------------------------------------------------------------
+class SessionInfo(Mapping):
+    # Read-only session information (mitls.sinfo), materialized from its
+    # .NET source (HttpWSGI.WsgiSessionInfo) on first access.
+
+    def __init__(self, source, items = None):
+        self._source = source
+        self._items  = items
+
+    def _materialize(self):
+        if self._items is None:
+            self._items  = dict([(kv.Key, kv.Value) for kv in self._source.Materialize()])
+            self._source = None
+        return self._items
+
+    def __getitem__(self, key):
+        return self._materialize()[key]
+
+    def __iter__(self):
+        return iter(self._materialize())
+
+    def __len__(self):
+        return len(self._materialize())
+
+    def __repr__(self):
+        return "SessionInfo(%r)" % (self._materialize(),)
+
+class SessionCache(object):
+    # SessionInfo objects by session key (ID or hash), so that requests
+    # of the same TLS session share one. At most [size] are kept.
+
+    EMPTY = SessionInfo(None, {})
+
+    def __init__(self, size = 1024):
+        self._size     = size
+        self._lock     = threading.Lock()
+        self._sessions = collections.OrderedDict()
+
+    def get(self, source):
+        if source is None:
+            return self.EMPTY
+        key = source.Key
+        with self._lock:
+            sinfo = self._sessions.pop(key, None)
+            if sinfo is None:
+                sinfo = SessionInfo(source)
+            self._sessions[key] = sinfo
+            if len(self._sessions) > self._size:
+                self._sessions.popitem(last = False)
+        return sinfo
+
+_sessions = SessionCache()
+
 # ------------------------------------------------------------------------
 class WSGIErrorStream(object):
     def __init__(self, basestream):
@@ -31,75 +165,251 @@ class WSGIErrorStream(object):
 
 # ------------------------------------------------------------------------
 class WSGIInputStream(object):
-    def __init__(self, basestream):
+    BLOCKSIZE = 16 * 1024
+
+    def __init__(self, basestream, length = None):
+        # [length] is the request body length (CONTENT_LENGTH): no
+        # more than [length] bytes are read, if not None.
+        #
+        # Bytes are read from [basestream] into a .NET buffer, then
+        # copied as is into a native one (no text decoding): both
+        # buffers are reused for the lifetime of the stream.
         assert isinstance(basestream, DotNet.IO.Stream)
         assert basestream.CanRead
-        enc = DotNet.Text.Encoding.GetEncoding("iso-8859-1")
         self._basestream = basestream
-        self._txtstream  = DotNet.IO.StreamReader(basestream, enc)
+        self._block      = DotNet.Array.CreateInstance(DotNet.Byte, self.BLOCKSIZE)
+        self._native     = ctypes.create_string_buffer(self.BLOCKSIZE)
+        self._address    = ctypes.addressof(self._native)
+        self._remaining  = length
+        self._buffer     = b''  # Data read by readline() but not consumed
+        self._offset     = 0
 
     basestream = property(lambda self : self._basestream)
+    remaining  = property(lambda self : self._remaining)
+
+    def reset(self, length = None):
+        # Start reading a new request body, of [length] bytes
+        self._remaining = length
+        self._buffer    = b''
+        self._offset    = 0
+
+    def _readblock(self, size):
+        # Read at most one block (and at most [size] bytes)
+        if self._remaining is not None:
+            size = min(size, self._remaining)
+        if size <= 0:
+            return b''
+        count = self._basestream.Read(self._block, 0, min(size, self.BLOCKSIZE))
+        if count <= 0:
+            self._remaining = 0
+            return b''
+        if self._remaining is not None:
+            self._remaining -= count
+        Marshal.Copy(self._block, 0, DotNet.IntPtr(self._address), count)
+        return ctypes.string_at(self._address, count)
+
+    def _readbuffer(self, size):
+        # Consume at most [size] bytes of the readline() buffer
+        end  = len(self._buffer) if size < 0 else min(len(self._buffer), self._offset + size)
+        aout = self._buffer[self._offset:end]
+        self._offset = end
+        return aout
 
     def read(self, size = -1):
-        if size < 0:
-            return self._txtstream.ReadToEnd()
+        if size is None:
+            size = -1
+        chunks = [self._readbuffer(size)]
+        if size >= 0:
+            size -= len(chunks[0])
+        while size != 0:
+            data = self._readblock(size if size > 0 else self.BLOCKSIZE)
+            if not data:
+                break
+            chunks.append(data)
+            if size > 0:
+                size -= len(data)
+        return b''.join(chunks)
 
     def readline(self, size = -1):
         # In WSGI 1.0, [size] can be omitted
-        aout = self._txtstream.ReadLine()
-        if aout is None:
-            return ''
-        return aout + DotNet.Environment.NewLine
+        if size is None:
+            size = -1
+        chunks = []
+        while size != 0:
+            if self._offset == len(self._buffer):
+                self._buffer, self._offset = self._readblock(self.BLOCKSIZE), 0
+                if not self._buffer:
+                    break
+            limit = len(self._buffer) if size < 0 else min(len(self._buffer), self._offset + size)
+            eol   = self._buffer.find(b'\n', self._offset, limit)
+            end   = limit if eol < 0 else eol + 1
+            chunks.append(self._buffer[self._offset:end])
+            if size > 0:
+                size -= end - self._offset
+            self._offset = end
+            if eol >= 0:
+                break
+        return b''.join(chunks)
 
     def readlines(self, size = -1):
         # In WSGI 1.0, [size] can be omitted
         return list(self)
 
+    def discard(self):
+        # Skip what the application did not read of the body, so that
+        # the next request of the connection can be read
+        self._buffer, self._offset = b'', 0
+        while self._readblock(self.BLOCKSIZE):
+            pass
+
     def __iter__(self):
         return iterfun(self.readline, lambda x : len(x) != 0)
 
 # ------------------------------------------------------------------------
 class WSGIOutputStream(object):
+    # One TLS record worth of plaintext
+    BLOCKSIZE = 16 * 1024
+    # For write_native(), allocated on first use
+    LARGEBLOCK = 256 * 1024
+
     def __init__(self, basestream):
+        # Written data is coalesced in a native buffer, handed over to
+        # [basestream] (through a reused byte[]) by blocks of BLOCKSIZE
+        # bytes, or on flush().
         assert isinstance(basestream, DotNet.IO.Stream)
         assert basestream.CanWrite
-        enc = DotNet.Text.Encoding.GetEncoding("iso-8859-1")
         self._basestream = basestream
-        self._txtstream  = DotNet.IO.StreamWriter(basestream, enc)
+        self._block      = DotNet.Array.CreateInstance(DotNet.Byte, self.BLOCKSIZE)
+        self._native     = ctypes.create_string_buffer(self.BLOCKSIZE)
+        self._address    = ctypes.addressof(self._native)
+        self._pending    = 0
+        self._large      = None
 
     basestream = property(lambda self : self._basestream)
 
+    def _drain(self):
+        if self._pending:
+            Marshal.Copy(DotNet.IntPtr(self._address), self._block, 0, self._pending)
+            self._basestream.Write(self._block, 0, self._pending)
+            self._pending = 0
+
     def write(self, data):
-        self._txtstream.Write(data)
+        data   = _bytes(data)
+        offset = 0
+        while offset < len(data):
+            count = min(len(data) - offset, self.BLOCKSIZE - self._pending)
+            ctypes.memmove(self._address + self._pending, data[offset:offset+count], count)
+            self._pending += count
+            offset        += count
+            if self._pending == self.BLOCKSIZE:
+                self._drain()
+
+    def write_native(self, address, count):
+        # Write [count] bytes from native memory at [address], handed
+        # over to [basestream] by blocks of LARGEBLOCK bytes (no
+        # intermediate Python string).
+        self._drain()
+        if self._large is None:
+            self._large = DotNet.Array.CreateInstance(DotNet.Byte, self.LARGEBLOCK)
+        while count > 0:
+            size = min(count, self.LARGEBLOCK)
+            Marshal.Copy(DotNet.IntPtr(address), self._large, 0, size)
+            self._basestream.Write(self._large, 0, size)
+            address += size
+            count   -= size
 
     def flush(self):
-        self._txtstream.Flush()
+        self._drain()
+        self._basestream.Flush()
 
     def close(self):
         try:
-            self._txtstream .Close()
+            self.flush()
             self._basestream.Close()
         finally:
-            self._txtstream  = None
             self._basestream = None
 
 # ------------------------------------------------------------------------
 class Bridge(object):
-    def __init__(self, config):
+    def __init__(self, config, streams = None, timings = None):
+        # [streams] are the (input, output, error) wrappers to use, see
+        # Dispatcher. They are created from [config] if None. The phases
+        # of the request are recorded in [timings] (wsgistats.Timings),
+        # if not None.
+        if streams is None:
+            streams = (WSGIInputStream(config['input']),
+                       WSGIOutputStream(config['output']),
+                       WSGIErrorStream(config['error']))
         self._url     = urlparse.urlparse(config['url'])
-        self._input   = WSGIInputStream(config['input'])
-        self._output  = WSGIOutputStream(config['output'])
-        self._error   = WSGIErrorStream(config['error'])
+        self._input, self._output, self._error = streams
         self._request = config['request']
-        self._sinfo   = config['sinfo']
+        self._length  = self._content_length(self._request)
+        self._input.reset(self._length or 0)
+        self._version = '1.1' if config['version'] == '1.1' else '1.0'
+        self._sinfo   = _sessions.get(config['sinfo'])
         self._headers = None
         self._hdsent  = False
+        self._chunked = False
+        self._nobody  = False
+        self._persist = self._length is not None and \
+                            self._keep_alive(self._request, self._version)
+        self._timings = timings
 
     url     = property(lambda self : self._url)
     input   = property(lambda self : self._input)
     output  = property(lambda self : self._output)
     error   = property(lambda self : self._error)
     request = property(lambda self : self._request)
+    version = property(lambda self : self._version)
+    timings = property(lambda self : self._timings)
+
+    @staticmethod
+    def _content_length(request):
+        # Without Content-Length, a request has no body. Returns None if
+        # the body cannot be delimited (Transfer-Encoding, or an invalid
+        # Content-Length): the application then sees an empty body, and
+        # the connection must not be kept alive, as the unread body
+        # would be parsed as the next request.
+        if request.headers.GetDfl("Transfer-Encoding", None) is not None:
+            return None
+        length = request.headers.GetDfl("Content-Length", "0").strip()
+        return int(length) if length.isdigit() else None
+
+    @staticmethod
+    def _keep_alive(request, version):
+        connection = request.headers.GetDfl("Connection", "").strip().lower()
+        if connection == 'close':
+            return False
+        if connection == 'keep-alive':
+            return True
+        return version == '1.1'
+
+    def _frame(self, status, headers):
+        # Choose how the response body is delimited: by Content-Length,
+        # chunked (HTTP/1.1), or by closing the connection (HTTP/1.0)
+        names = set([hk.lower() for hk, _ in headers])
+        code  = status.split(None, 1)[0]
+
+        if 'connection' in names:
+            self._persist = self._persist and \
+                'close' not in [hv.lower() for hk, hv in headers if hk.lower() == 'connection']
+
+        if self._request.mthod == 'HEAD' or code in ('204', '304') or code.startswith('1'):
+            self._nobody = True
+        elif 'content-length' not in names:
+            if self._version == '1.1' and 'transfer-encoding' not in names:
+                headers = headers + [('Transfer-Encoding', 'chunked')]
+                self._chunked = True
+            else:
+                self._persist = False
+
+        if 'connection' not in names:
+            if not self._persist and self._version == '1.1':
+                headers = headers + [('Connection', 'close')]
+            elif self._persist and self._version != '1.1':
+                headers = headers + [('Connection', 'keep-alive')]
+
+        return headers
 
     def send_headers(self):
         if self._headers is None:
@@ -107,23 +417,76 @@ class Bridge(object):
         if self._hdsent:
             raise AssertionError("send_headers() with headers already sent")
 
+        # Headers are buffered with the beginning of the body
         status, headers = self._headers
+        headers = self._frame(status, headers)
         try:
-            self._output.write('%s %s\r\n' % ("HTTP/1.0", status,))
-            for hk, hv in headers:
-                self._output.write('%s: %s\r\n' % (hk, hv))
-            self._output.write('\r\n')
-            self._output.flush()
+            lines = ['HTTP/%s %s' % (self._version, status,)]
+            lines.extend(['%s: %s' % (hk, hv) for hk, hv in headers])
+            self._output.write(_bytes('\r\n'.join(lines) + '\r\n\r\n'))
         finally:
             self._hdsent = True
+            if self._timings is not None:
+                self._timings.status       = status
+                self._timings.first_output = self._timings.mark()
 
     def write(self, data):
         if self._headers is None:
             raise AssertionError("write() before start_response()")
         if not self._hdsent:
             self.send_headers()
-        self._output.write(data)
-        self._output.flush()
+        if self._nobody or not data:
+            return
+        data = _bytes(data)
+        if self._timings is not None:
+            self._timings.bytes += len(data)
+        if self._chunked:
+            self._output.write(_bytes('%x\r\n' % (len(data),)))
+            self._output.write(data)
+            self._output.write(b'\r\n')
+        else:
+            self._output.write(data)
+
+    def sendfile(self, wrapper):
+        # Send the remainder of the file of [wrapper] (a FileWrapper)
+        # from a memory mapping of it. Returns False, with nothing sent,
+        # if the file cannot be mapped.
+        fd = wrapper.fileno()
+        if fd is None:
+            return False
+        offset = wrapper.tell()
+        if os.fstat(fd).st_size <= offset:
+            return False
+        try:
+            # Copy-on-write: ctypes only exports writable buffers
+            mapping = mmap.mmap(fd, 0, access = mmap.ACCESS_COPY)
+        except (EnvironmentError, ValueError):
+            return False
+        try:
+            view = (ctypes.c_char * len(mapping)).from_buffer(mapping)
+            try:
+                size = len(mapping) - offset
+                self.write(b'')
+                if self._nobody:
+                    return True
+                if self._timings is not None:
+                    self._timings.bytes += size
+                if self._chunked:
+                    self._output.write(_bytes('%x\r\n' % (size,)))
+                self._output.write_native(ctypes.addressof(view) + offset, size)
+                if self._chunked:
+                    self._output.write(b'\r\n')
+            finally:
+                del view
+        finally:
+            mapping.close()
+        return True
+
+    def flush(self):
+        if self._hdsent:
+            self._output.flush()
+            if self._timings is not None:
+                self._timings.flushes += 1
 
     def start_response(self, status, headers, exc_info=None):
         if exc_info is None:
@@ -136,21 +499,16 @@ class Bridge(object):
         # TODO: check headers here
         return self.write
 
-    def __call__(self, application):
+    def environ(self):
         path = [x for x in self.url.path.split('/') if x]
         if path[:1] != ['wsgi']:
             raise AssertionError("path does not start with `/wsgi'")
 
-        environ = dict(os.environ.items())
+        environ = base_environ(self.url.scheme).copy()
         environ['wsgi.input'  ]       = self._input
         environ['wsgi.errors' ]       = self._error
-        environ['wsgi.version']       = (1, 0)
-        environ['wsgi.multithreaded'] = True
-        environ['wsgi.multiprocess' ] = False
-        environ['wsgi.run_once'     ] = True
-        environ['wsgi.url_scheme'   ] = self.url.scheme
         environ['mitls.sinfo']        = self._sinfo
-        environ['HTTPS']              = '1' if self.url.scheme == 'https' else '0'
+        environ['mitls.flush']        = self.flush
 
         environ['REQUEST_METHOD']  = self._request.mthod
         environ['SCRIPT_NAME']     = '/%s' % path[0]
@@ -159,16 +517,49 @@ class Bridge(object):
         environ['CONTENT_LENGTH']  = self._request.headers.GetDfl("Content-Length", "")
         environ['QUERY_STRING']    = self.url.query
         environ['SERVER_NAME']     = self.url.hostname
-        environ['SERVER_PORT']     = self.url.port or socket.getservbyname(self.url.scheme, 'tcp')
-        environ['SERVER_PROTOCOL'] = 'HTTP/1.0'
+        environ['SERVER_PORT']     = self.url.port or server_port(self.url.scheme)
+        environ['SERVER_PROTOCOL'] = 'HTTP/%s' % (self._version,)
+
+        if self._timings is not None:
+            self._timings.environ = self._timings.mark()
+        return environ
+
+    def finish(self):
+        # Terminate the response, and get ready for the next request of
+        # the connection. Returns whether it can be kept alive.
+        if not self._hdsent:
+            self.write(b'')
+        if self._chunked:
+            self._output.write(b'0\r\n\r\n')
+        self._output.flush()
+        if self._timings is not None:
+            self._timings.flushes += 1
+
+        if self._persist:
+            self._input.discard()
+        if self._timings is not None:
+            self._timings.total = self._timings.mark()
+        return self._persist
 
-        result = application(environ, self.start_response)
+    def __call__(self, application):
+        # Output is coalesced (see WSGIOutputStream) within a block of
+        # the result, and with the headers. Each block is flushed before
+        # the next one is asked for, as WSGI does not allow a block to
+        # wait for the application to produce the next one (e.g. when
+        # streaming), except for lists and tuples, whose blocks are all
+        # ready: they are sent as one. Data passed to write() (the
+        # start_response one) is sent with the next block, on
+        # environ['mitls.flush'], or at the end of the response.
+        result = application(self.environ(), self.start_response)
         try:
-            for data in result:
-                if data:
-                    self.write(data)
-            if not self._hdsent:
-                self.write('')
+            if not (isinstance(result, FileWrapper) and self.sendfile(result)):
+                ready = isinstance(result, (list, tuple))
+                for data in result:
+                    if data:
+                        self.write(data)
+                        if not ready:
+                            self.flush()
+            return self.finish()
         finally:
             if hasattr(result, 'close'):
                 result.close()
@@ -178,6 +569,64 @@ class Bridge(object):
         fields = ["%s = %r" % (k, getattr(self, k)) for k in fields]
         return "Bridge[%s]" % ", ".join(fields)
 
+# ------------------------------------------------------------------------
+class Dispatcher(object):
+    # Long-lived entry point of the bridge, created once by HttpWSGI.
+    # The stream wrappers are pooled by connection (config['connection'])
+    # and reused by the requests of a keep-alive connection, until
+    # release() is called.
+    #
+    # HttpServer calls the dispatcher from one thread per connection, and
+    # the bridge releases the interpreter lock while blocked on the
+    # network, so calls for different connections run concurrently. The
+    # pool of stream wrappers is guarded by [_lock]; the wrappers of a
+    # connection are only used by that connection's thread, one request
+    # at a time. The session cache and the sinks have their own locks.
+    #
+    # Requests are timed when [sinks] (see wsgistats, defaults to the
+    # ones of $MITLS_WSGI_STATS) is not empty. A histogram sink is also
+    # served at wsgistats.STATS_PATH.
+
+    def __init__(self, application, sinks = None):
+        self._application = application
+        self._lock        = threading.Lock()
+        self._streams     = dict()
+        self._sinks       = wsgistats.from_environ() if sinks is None else sinks
+        self._stats       = None
+        for sink in self._sinks:
+            if isinstance(sink, wsgistats.HistogramSink):
+                self._stats = sink.application
+                break
+
+    def __call__(self, config):
+        # Returns whether the connection can be kept alive
+        connection = config['connection']
+        with self._lock:
+            streams = self._streams.get(connection, None)
+            if streams is None:
+                streams = (WSGIInputStream(config['input']),
+                           WSGIOutputStream(config['output']),
+                           WSGIErrorStream(config['error']))
+                self._streams[connection] = streams
+
+        if not self._sinks:
+            return Bridge(config, streams)(self._application)
+
+        url     = urlparse.urlparse(config['url'])
+        timings = wsgistats.Timings(config['request'].mthod, url.path)
+        try:
+            if self._stats is not None and url.path == wsgistats.STATS_PATH:
+                return Bridge(config, streams, timings)(self._stats)
+            return Bridge(config, streams, timings)(self._application)
+        finally:
+            for sink in self._sinks:
+                sink.record(timings)
+
+    def release(self, connection):
+        with self._lock:
+            self._streams.pop(connection, None)
+
 # ------------------------------------------------------------------------
 def _entry(config, application):
-    Bridge(config)(application)
+    # Returns whether the connection can be kept alive
+    return Bridge(config)(application)
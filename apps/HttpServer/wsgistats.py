@@ -0,0 +1,147 @@
+﻿# ------------------------------------------------------------------------
+# Per-request timings of the WSGI bridge, and the sinks they go to.
+#
+# Sinks are selected by $MITLS_WSGI_STATS, a comma-separated list of:
+#
+#   log         one line per request, on stderr
+#   histogram   in-memory distributions, served as text at STATS_PATH
+#
+# Without it, requests are not timed.
+
+# ------------------------------------------------------------------------
+import sys, os, time, math, threading, collections
+
+# ------------------------------------------------------------------------
+__all__ = ['Timings', 'LogSink', 'HistogramSink', 'from_environ']
+
+# ------------------------------------------------------------------------
+STATS_PATH  = '/wsgi/_stats'
+PERCENTILES = (50, 90, 99)
+
+clock = getattr(time, 'perf_counter', time.time)
+
+# ------------------------------------------------------------------------
+class Timings(object):
+    # Timings of one request. Phases (environ build, first output of
+    # the application, total) are in microseconds since the request
+    # start and are None if not reached (e.g. the application failed).
+    #
+    # first_output is when the application produced its first output
+    # (the headers are then formatted), not a time to first byte: the
+    # bridge coalesces output, and the headers may only reach the wire
+    # with the first flush (see wsgibridge.WSGIOutputStream).
+
+    PHASES = ('environ', 'first_output', 'total')
+    COUNTS = ('bytes', 'flushes')
+
+    __slots__ = ('method', 'path', 'status', 'start') + PHASES + COUNTS
+
+    def __init__(self, method, path):
+        self.method       = method
+        self.path         = path
+        self.status       = None
+        self.start        = clock()
+        self.environ      = None
+        self.first_output = None
+        self.total        = None
+        self.bytes        = 0
+        self.flushes      = 0
+
+    def mark(self):
+        return (clock() - self.start) * 1e6
+
+# ------------------------------------------------------------------------
+def _us(value):
+    return '-' if value is None else '%.0fus' % (value,)
+
+class LogSink(object):
+    def __init__(self, stream = None):
+        self._stream = sys.stderr if stream is None else stream
+        self._lock   = threading.Lock()
+
+    def record(self, timings):
+        line = '%s %s %s environ=%s first_output=%s total=%s bytes=%d flushes=%d\n' % \
+            (timings.method, timings.path, (timings.status or '-').split(None, 1)[0],
+             _us(timings.environ), _us(timings.first_output), _us(timings.total),
+             timings.bytes, timings.flushes)
+        with self._lock:
+            self._stream.write(line)
+            self._stream.flush()
+
+# ------------------------------------------------------------------------
+class HistogramSink(object):
+    # Distributions of the last [size] requests, by phase and count,
+    # and the number of requests by status.
+
+    def __init__(self, size = 4096):
+        self._lock     = threading.Lock()
+        self._requests = 0
+        self._status   = collections.defaultdict(int)
+        self._samples  = dict([(k, collections.deque(maxlen = size)) \
+                                   for k in Timings.PHASES + Timings.COUNTS])
+
+    def record(self, timings):
+        with self._lock:
+            self._requests += 1
+            self._status[(timings.status or 'error').split(None, 1)[0]] += 1
+            for k, samples in self._samples.items():
+                value = getattr(timings, k)
+                if value is not None:
+                    samples.append(value)
+
+    @staticmethod
+    def _summary(samples):
+        if not samples:
+            return dict(count = 0)
+        samples = sorted(samples)
+        summary = dict(count = len(samples),
+                       mean  = sum(samples) / float(len(samples)),
+                       max   = samples[-1])
+        for p in PERCENTILES:
+            rank = max(1, int(math.ceil(p / 100.0 * len(samples))))
+            summary['p%d' % (p,)] = samples[rank-1]
+        return summary
+
+    def summary(self):
+        with self._lock:
+            samples  = dict([(k, list(v)) for k, v in self._samples.items()])
+            requests = self._requests
+            status   = dict(self._status)
+        return dict(requests = requests, status = status,
+                    phases   = dict([(k, self._summary(v)) for k, v in samples.items()]))
+
+    def render(self):
+        summary = self.summary()
+        lines   = ['requests %d' % (summary['requests'],)]
+        lines.extend(['status %s %d' % x for x in sorted(summary['status'].items())])
+        for k in Timings.PHASES + Timings.COUNTS:
+            data  = summary['phases'][k]
+            unit  = 'us' if k in Timings.PHASES else ''
+            parts = ['count=%d' % (data['count'],)]
+            if data['count']:
+                parts.append('mean=%.0f%s' % (data['mean'], unit))
+                parts.extend(['p%d=%.0f%s' % (p, data['p%d' % (p,)], unit) for p in PERCENTILES])
+                parts.append('max=%.0f%s' % (data['max'], unit))
+            lines.append('%s %s' % (k, ' '.join(parts)))
+        return '\n'.join(lines) + '\n'
+
+    def application(self, environ, start_response):
+        # The STATS_PATH endpoint
+        body = self.render().encode('ascii')
+        start_response('200 OK', [('Content-Type', 'text/plain'),
+                                  ('Content-Length', str(len(body))),
+                                  ('Cache-Control', 'no-cache')])
+        return [body]
+
+# ------------------------------------------------------------------------
+SINKS = dict(log = LogSink, histogram = HistogramSink)
+
+def from_environ(spec = None):
+    # The sinks named in [spec] (defaults to $MITLS_WSGI_STATS)
+    if spec is None:
+        spec = os.environ.get('MITLS_WSGI_STATS', '')
+    names = [x.strip().lower() for x in spec.split(',') if x.strip()]
+    for name in names:
+        if name not in SINKS:
+            raise ValueError("unknown WSGI stats sink: `%s'" % (name,))
+    return [SINKS[name]() for name in names]
@@ -1,10 +1,6 @@
 #!/bin/bash
 
-rm -f results
+# Bulk-transfer benchmark of cmitls.exe; see tests/bench/cmitlsbench.py -h
+# e.g. ./benchmark.sh -s 100000,10000000 -c TLS_AES_128_GCM_SHA256 -o results.json
 
-for i in $(seq 10); do \
-    DYLD_LIBRARY_PATH=../../src/tls/extract/Kremlin-Library:../../src/pki:../../../MLCrypto/openssl \
-                     gtime -f '%U' ./cmitls.exe 0.0.0.0 4443 100000 -quiet 2>&1 | tail -1 | tee -a results;
-done
-
-awk '{ total += $1; count++ } END { print 100000/(total/count) " kB/s"}' results
+exec python2 "$(dirname "$0")/../../tests/bench/cmitlsbench.py" "$@"
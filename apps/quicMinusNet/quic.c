@@ -4,6 +4,7 @@
 #include <unistd.h>
 #include <assert.h>
 #include <sys/stat.h>
+#include <sys/time.h>
 #include <sys/cdefs.h>
 #if __APPLE__
 #include <sys/errno.h> // OS/X only provides include/sys/errno.h
@@ -112,6 +113,125 @@ void reset_ctx(quic_process_ctx *cctx, quic_process_ctx *sctx, unsigned char *cb
   sctx->flags = 0;
 }
 
+// Same as half_round, without the record-key checks, and returning the
+// time spent in FFI_mitls_quic_process (in us)
+double timed_half_round(quic_state *my_state, quic_process_ctx *my_ctx, quic_process_ctx *peer_ctx)
+{
+  struct timeval tv1, tv2;
+  size_t old_olen = my_ctx->output_len;
+
+  (void) gettimeofday(&tv1, NULL);
+  if(!FFI_mitls_quic_process(my_state, my_ctx))
+  {
+    fprintf(stderr, "Error %d returned.\n", my_ctx->tls_error);
+    exit(my_ctx->tls_error & 255);
+  }
+  (void) gettimeofday(&tv2, NULL);
+
+  my_ctx->output += my_ctx->output_len;
+  my_ctx->input += my_ctx->consumed_bytes;
+  my_ctx->input_len -= my_ctx->consumed_bytes;
+  peer_ctx->input_len += my_ctx->output_len;
+  my_ctx->output_len = old_olen - my_ctx->output_len;
+
+  return (tv2.tv_sec - tv1.tv_sec) * 1000000.0 + (tv2.tv_usec - tv1.tv_usec);
+}
+
+// Tickets are not used (nor kept) by the benchmark mode
+void bench_ticket_cb(void *st, const char *sni, const mitls_ticket *ticket)
+{
+}
+
+// Benchmark mode: HSCOUNT (default 100) in-memory 1-RTT handshakes,
+// after a warm-up one. The usual trace goes to the null device; the
+// results are printed in the tests/bench clients format, per-handshake
+// and per-process-call timings included when HSTIMES is set.
+int run_bench(quic_config *config, connection_state *server, connection_state *client)
+{
+  const char *cs = getenv("CIPHERSUITE");
+  const char *hscount = getenv("HSCOUNT");
+  unsigned count = hscount != NULL ? (unsigned) atoi(hscount) : 100;
+  int hstimes = getenv("HSTIMES") != NULL;
+
+  size_t smax = 8*1024, cmax = 8*1024;
+  unsigned char sbuf[smax], cbuf[cmax];
+  quic_process_ctx cctx, sctx;
+  struct timeval tv1, tv2;
+  double calls[64], hsticks = 0;
+  unsigned ncalls, hsdone = 0;
+
+  config->ticket_callback = bench_ticket_cb;
+  if(cs == NULL)
+    cs = "default";
+
+  FILE *report = fdopen(dup(fileno(stdout)), "w");
+#if _WIN32
+  if(report == NULL || freopen("NUL", "w", stdout) == NULL)
+#else
+  if(report == NULL || freopen("/dev/null", "w", stdout) == NULL)
+#endif
+  {
+    perror("redirecting stdout");
+    return 1;
+  }
+
+  for(unsigned n = 0; n <= count; n++)
+  {
+    reset_ctx(&cctx, &sctx, cbuf, sbuf, cmax, smax);
+    ncalls = 0;
+
+    (void) gettimeofday(&tv1, NULL);
+
+    config->is_server = 1;
+    config->callback_state = server;
+    if(!FFI_mitls_quic_create(&server->quic_state, config)) return 1;
+
+    config->is_server = 0;
+    config->callback_state = client;
+    if(!FFI_mitls_quic_create(&client->quic_state, config)) return 1;
+
+    for(int post_hs = 0; post_hs < 2; )
+    {
+      // We need one extra round of post-handshake for NST
+      if(COMPLETE(cctx) && COMPLETE(sctx)) post_hs++;
+
+      double c = timed_half_round(client->quic_state, &cctx, &sctx);
+      double s = timed_half_round(server->quic_state, &sctx, &cctx);
+      if(ncalls + 2 <= sizeof(calls) / sizeof(calls[0]))
+      {
+        calls[ncalls++] = c;
+        calls[ncalls++] = s;
+      }
+    }
+
+    FFI_mitls_quic_free(server->quic_state);
+    FFI_mitls_quic_free(client->quic_state);
+
+    (void) gettimeofday(&tv2, NULL);
+
+    double ticks = (tv2.tv_sec - tv1.tv_sec) * 1000000.0 + (tv2.tv_usec - tv1.tv_usec);
+
+    if(n != 0)
+    {
+      hsdone  += 1;
+      hsticks += ticks;
+
+      if(hstimes)
+      {
+        fprintf(report, "%s: %.2f us/HS\n", cs, ticks);
+        for(unsigned i = 0; i < ncalls; i++)
+          fprintf(report, "%s: %.2f us/call\n", cs, calls[i]);
+      }
+    }
+  }
+
+  fprintf(report, "%s: %.2f HS/s\n", cs, hsdone / (hsticks / 1000000));
+  fprintf(report, "%s: %u HS\n", cs, count + 1);
+  fclose(report);
+
+  return 0;
+}
+
 int main(int argc, char **argv)
 {
   hs_type mode = handshake_simple;
@@ -124,6 +244,8 @@ int main(int argc, char **argv)
       mode = handshake_0rtt_reject;
     if(!strcasecmp(argv[1], "hrr"))
       mode = handshake_stateless_retry;
+    if(!strcasecmp(argv[1], "bench"))
+      mode = handshake_bench;
   }
 
   // Server PKI configuration: one ECDSA certificate
@@ -194,11 +316,22 @@ int main(int argc, char **argv)
     .ticket_key_len = 0
   };
 
+  // Cipher suite override (e.g. tests/bench/quicbench.py)
+  if(getenv("CIPHERSUITE") != NULL)
+    config.cipher_suites = getenv("CIPHERSUITE");
+
   connection_state server = {.quic_state=NULL, pki=pki };
   connection_state client = {.quic_state=NULL, pki=pki };
 
   FFI_mitls_init();
 
+  if (mode == handshake_bench)
+  {
+    int r = run_bench(&config, &server, &client);
+    mipki_free(pki);
+    return r;
+  }
+
   size_t slen = 0, clen = 0, smax = 8*1024, cmax = 8*1024, plen;
   unsigned char sbuf[smax], cbuf[cmax], plain[2048], cipher[2048];
   quic_process_ctx cctx, sctx;
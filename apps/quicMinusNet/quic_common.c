@@ -3,7 +3,8 @@ typedef enum {
   handshake_simple,
   handshake_0rtt,
   handshake_0rtt_reject,
-  handshake_stateless_retry
+  handshake_stateless_retry,
+  handshake_bench
 } hs_type;
 
 typedef struct {
@@ -0,0 +1,590 @@
+# --------------------------------------------------------------------
+import os, re, errno, math, time, socket, json, platform, fnmatch, itertools, threading
+
+# --------------------------------------------------------------------
+class Object(object):
+    def __init__(self, **kw):
+        self.__dict__.update(kw)
+
+# --------------------------------------------------------------------
+OPENSSL_CIPHERS = {
+    'TLS_RSA_WITH_RC4_128_MD5'            : 'RC4-MD5'                ,
+    'TLS_RSA_WITH_RC4_128_SHA'            : 'RC4-SHA'                ,
+    'TLS_RSA_WITH_3DES_EDE_CBC_SHA'       : 'DES-CBC3-SHA'           ,
+    'TLS_RSA_WITH_AES_128_CBC_SHA'        : 'AES128-SHA'             ,
+    'TLS_RSA_WITH_AES_128_CBC_SHA256'     : 'AES128-SHA256'          ,
+    'TLS_RSA_WITH_AES_256_CBC_SHA'        : 'AES256-SHA'             ,
+    'TLS_RSA_WITH_AES_256_CBC_SHA256'     : 'AES256-SHA256'          ,
+    'TLS_RSA_WITH_AES_128_GCM_SHA256'     : 'AES128-GCM-SHA256'      ,
+    'TLS_RSA_WITH_AES_256_GCM_SHA384'     : 'AES256-GCM-SHA384'      ,
+    'TLS_DHE_DSS_WITH_3DES_EDE_CBC_SHA'   : 'EDH-DSS-DES-CBC3-SHA'   ,
+    'TLS_DHE_DSS_WITH_AES_128_CBC_SHA'    : 'DHE-DSS-AES128-SHA'     ,
+    'TLS_DHE_DSS_WITH_AES_128_CBC_SHA256' : 'DHE-DSS-AES128-SHA256'  ,
+    'TLS_DHE_DSS_WITH_AES_256_CBC_SHA'    : 'DHE-DSS-AES256-SHA'     ,
+    'TLS_DHE_DSS_WITH_AES_256_CBC_SHA256' : 'DHE-DSS-AES256-SHA256'  ,
+    'TLS_DHE_RSA_WITH_AES_128_CBC_SHA'    : 'DHE-RSA-AES128-SHA'     ,
+    'TLS_DHE_RSA_WITH_AES_256_CBC_SHA'    : 'DHE-RSA-AES256-SHA'     ,
+}
+
+# --------------------------------------------------------------------
+SSL_PROTOCOLS = {
+    'TLS_1p0' : 'PROTOCOL_TLSv1'  ,
+    'TLS_1p1' : 'PROTOCOL_TLSv1_1',
+    'TLS_1p2' : 'PROTOCOL_TLSv1_2',
+}
+
+def ssl_context(cipher, version = None):
+    """
+    Client-side SSL context (no certificate verification) for [cipher]
+    and [version] (defaults to $TLSVERSION, then TLS_1p2). Raises
+    ValueError if the version is not supported by the ssl module.
+    """
+    import ssl
+
+    if version is None:
+        version = os.environ.get('TLSVERSION', 'TLS_1p2')
+    protocol = getattr(ssl, SSL_PROTOCOLS.get(version, ''), None)
+    if protocol is None:
+        raise ValueError('unsupported TLS version: %s' % (version,))
+
+    context = ssl.SSLContext(protocol)
+    context.verify_mode = ssl.CERT_NONE
+    context.set_ciphers(OPENSSL_CIPHERS.get(cipher, cipher))
+    return context
+
+# --------------------------------------------------------------------
+CONFIG_FIELDS = ('matrix', 'pki', 'certname', 'cipher', 'version', 'payload')
+
+def load_matrices(filename, names = None):
+    """
+    Expand the config matrices of [filename] (all the ones listed in
+    `[config].matrices' if [names] is None) into a list of configs.
+    """
+    import ConfigParser as cp
+
+    parser = cp.ConfigParser()
+    if not parser.read(filename):
+        raise ValueError("cannot read `%s'" % (filename,))
+
+    if names is None:
+        if not parser.has_option('config', 'matrices'):
+            raise ValueError("missing `[config].matrices' option")
+        names = parser.get('config', 'matrices').split()
+
+    configs = []
+
+    for name in names:
+        if not parser.has_section(name):
+            raise ValueError("no section for matrix `%s'" % (name,))
+        for x in ('pki', 'certname', 'ciphers', 'versions'):
+            if not parser.has_option(name, x):
+                raise ValueError("missing `[%s].%s' option" % (name, x))
+
+        axes = [parser.get(name, x).split() \
+                    for x in ('pki', 'certname', 'ciphers', 'versions')]
+        axes.append([int(x) for x in parser.get(name, 'payloads').split()] or [None])
+
+        for pki, certname, cipher, version, payload in itertools.product(*axes):
+            configs.append(Object(matrix = name, pki = pki, certname = certname,
+                                  cipher = cipher, version = version,
+                                  payload = payload))
+
+    return configs
+
+# --------------------------------------------------------------------
+class ConfigFilter(object):
+    """
+    Config filter expressions. An expression is a whitespace-separated
+    list of terms that must all hold:
+
+      field=glob[,glob...]   field matches one of the (fnmatch) globs
+      field~regex            regex matches (re.search) the field
+      word                   the cipher contains [word]
+
+    where field is one of CONFIG_FIELDS. A term prefixed by `!' is
+    negated. A config is selected if it satisfies any of the include
+    expressions (or if there are none) and none of the exclude ones.
+    """
+
+    def __init__(self, includes = (), excludes = ()):
+        self._includes = [self._compile(x) for x in includes]
+        self._excludes = [self._compile(x) for x in excludes]
+
+    @staticmethod
+    def _compile(expr):
+        terms = []
+
+        for term in expr.split():
+            negate = term.startswith('!')
+            term   = term[1:] if negate else term
+            m      = re.search(r'^(\w+)([=~])(.*)$', term)
+
+            if m is None:
+                terms.append(Object(negate = negate, op = 'in', field = 'cipher', arg = term))
+                continue
+
+            field, op, arg = m.groups()
+            if field not in CONFIG_FIELDS:
+                raise ValueError("unknown config field `%s'" % (field,))
+            arg = arg.split(',') if op == '=' else re.compile(arg)
+            terms.append(Object(negate = negate, op = op, field = field, arg = arg))
+
+        return terms
+
+    @staticmethod
+    def _holds(term, config):
+        value = str(getattr(config, term.field))
+
+        if term.op == 'in':
+            holds = term.arg in value
+        elif term.op == '=':
+            holds = any([fnmatch.fnmatchcase(value, x) for x in term.arg])
+        else:
+            holds = term.arg.search(value) is not None
+
+        return holds != term.negate
+
+    def _matches(self, expr, config):
+        return all([self._holds(x, config) for x in expr])
+
+    def __call__(self, config):
+        if self._includes:
+            if not any([self._matches(x, config) for x in self._includes]):
+                return False
+        return not any([self._matches(x, config) for x in self._excludes])
+
+    def filter(self, configs):
+        return [x for x in configs if self(x)]
+
+    @staticmethod
+    def of_mode(mode):
+        """Filter of the legacy MODE syntax: `[!]word:[!]word:...'"""
+        return ConfigFilter([' '.join([x for x in mode.split(':') if x])])
+
+# --------------------------------------------------------------------
+def _read_sysfs(path, dfl = None):
+    try:
+        with open(path, 'r') as stream:
+            return stream.read().strip()
+    except (IOError, OSError):
+        return dfl
+
+# --------------------------------------------------------------------
+def allowed_cpus():
+    """Logical CPUs this process is allowed to run on"""
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+
+    status = _read_sysfs('/proc/self/status', '')
+    m = re.search(r'^Cpus_allowed_list:\s*(\S+)$', status, re.M)
+    if m is not None:
+        return parse_cpulist(m.group(1))
+
+    import multiprocessing
+    return range(multiprocessing.cpu_count())
+
+# --------------------------------------------------------------------
+def parse_cpulist(spec):
+    """Parse a Linux CPU list (e.g. `0-3,8,10-11')"""
+    cpus = []
+    for item in [x.strip() for x in spec.split(',') if x.strip()]:
+        if '-' in item:
+            lo, hi = item.split('-', 1)
+            cpus.extend(range(int(lo), int(hi)+1))
+        else:
+            cpus.append(int(item))
+    return sorted(set(cpus))
+
+def format_cpulist(cpus):
+    return ','.join([str(x) for x in sorted(cpus)])
+
+# --------------------------------------------------------------------
+def cpu_topology():
+    """Return the (cpu, core, package) triple of each allowed logical CPU"""
+    topology = []
+
+    for cpu in allowed_cpus():
+        base = '/sys/devices/system/cpu/cpu%d/topology' % (cpu,)
+        core = _read_sysfs(os.path.join(base, 'core_id'), cpu)
+        pkg  = _read_sysfs(os.path.join(base, 'physical_package_id'), 0)
+        topology.append(Object(cpu = cpu, core = int(core), package = int(pkg)))
+
+    return topology
+
+# --------------------------------------------------------------------
+def cpu_slots(nslots, width = 1):
+    """
+    Split the allowed CPUs into [nslots] pairs of disjoint (server,
+    client) sets of [width] CPUs each. Physical cores are handed out
+    before their SMT siblings, so that no two sets share a core as long
+    as there are enough of them.
+    """
+    topology = cpu_topology()
+    bycore   = dict()
+
+    for x in topology:
+        bycore.setdefault((x.package, x.core), []).append(x.cpu)
+
+    cores = sorted(bycore.keys())
+    cpus  = []
+    for i in range(max([len(x) for x in bycore.values()] or [0])):
+        cpus.extend([bycore[x][i] for x in cores if i < len(bycore[x])])
+
+    if len(cpus) < 2 * nslots * width:
+        raise ValueError('%d CPU(s) available, %d needed' % \
+                             (len(cpus), 2 * nslots * width))
+
+    slots = []
+    for i in range(nslots):
+        base = 2 * i * width
+        slots.append((cpus[base:base+width], cpus[base+width:base+2*width]))
+    return slots
+
+# --------------------------------------------------------------------
+def pinned(command, cpus):
+    """
+    Return the (command, preexec_fn) pair that runs [command] pinned to
+    [cpus]. Uses os.sched_setaffinity when available, and taskset(1)
+    otherwise.
+    """
+    if not cpus:
+        return (command, None)
+
+    if hasattr(os, 'sched_setaffinity'):
+        def preexec():
+            os.sched_setaffinity(0, cpus)
+        return (command, preexec)
+
+    taskset = 'taskset -c %s ' % (format_cpulist(cpus),)
+    if isinstance(command, basestring):
+        return (taskset + command, None)
+    return (taskset.split() + list(command), None)
+
+# --------------------------------------------------------------------
+def wait_for_port(port, host = '127.0.0.1', timeout = 10.0, process = None):
+    """Wait until something listens on [host:port]"""
+    deadline = time.time() + timeout
+
+    while time.time() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError('server exited with code %d' % (process.returncode,))
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            sock.connect((host, port))
+            return
+        except socket.error:
+            time.sleep(0.05)
+        finally:
+            sock.close()
+
+    raise RuntimeError('nothing listening on %s:%d' % (host, port))
+
+# --------------------------------------------------------------------
+def parse_client_output(text):
+    """
+    Parse the `<cipher>: <value> HS/s|MiB/s|us/HS|us/call|HS|bytes'
+    lines of a bench client. Per-handshake timings (us/HS) are collected
+    in [hs_us], the per-call ones of the QUIC bench (us/call) in
+    [call_us], and the `<cipher>: load {...}' samples of loadgen.py in
+    [load]. The HS and bytes lines give the total number of handshakes
+    done and of application bytes sent.
+    """
+    result = dict()
+
+    for line in text.splitlines():
+        line = re.sub('#.*$', '', line)
+        m1   = re.search('^(.*?): ((:?\d|\.)+) HS/s$' , line)
+        m2   = re.search('^(.*?): ((:?\d|\.)+) MiB/s$', line)
+        m3   = re.search('^(.*?): ((:?\d|\.)+) us/HS$', line)
+        m4   = re.search('^(.*?): load (\{.*\})$', line)
+        m5   = re.search('^(.*?): (\d+) HS$', line)
+        m6   = re.search('^(.*?): (\d+) bytes$', line)
+        m7   = re.search('^(.*?): ((:?\d|\.)+) us/call$', line)
+
+        if m1 is not None:
+            result.setdefault(m1.group(1), {})['HS'] = float(m1.group(2))
+        if m2 is not None:
+            result.setdefault(m2.group(1), {})['rate'] = float(m2.group(2))
+        if m3 is not None:
+            result.setdefault(m3.group(1), {}) \
+                  .setdefault('hs_us', []).append(float(m3.group(2)))
+        if m4 is not None:
+            result.setdefault(m4.group(1), {}) \
+                  .setdefault('load', []).append(json.loads(m4.group(2)))
+        if m5 is not None:
+            result.setdefault(m5.group(1), {})['hs_count'] = int(m5.group(2))
+        if m6 is not None:
+            result.setdefault(m6.group(1), {})['bytes'] = int(m6.group(2))
+        if m7 is not None:
+            result.setdefault(m7.group(1), {}) \
+                  .setdefault('call_us', []).append(float(m7.group(2)))
+
+    return result
+
+# --------------------------------------------------------------------
+PERCENTILES = (50.0, 90.0, 99.0, 99.9)
+
+class Histogram(object):
+    """
+    HDR-style histogram: values are recorded in buckets whose width
+    grows with the magnitude of the value, so that the relative error of
+    any reported quantile is bounded by [digits] significant decimal
+    digits, whatever the dynamic range.
+    """
+
+    def __init__(self, digits = 3):
+        self._digits = digits
+        self._counts = dict()
+        self._count  = 0
+        self._total  = 0.0
+        self._min    = None
+        self._max    = None
+
+    count = property(lambda self : self._count)
+    min   = property(lambda self : self._min)
+    max   = property(lambda self : self._max)
+    mean  = property(lambda self : self._total / self._count if self._count else None)
+
+    def _bucket(self, value):
+        if value <= 0:
+            return (0, 0)
+        exp = int(math.floor(math.log10(value))) - (self._digits - 1)
+        return (int(value / 10.0 ** exp), exp)
+
+    def _bounds(self, bucket):
+        mant, exp = bucket
+        return (mant * 10.0 ** exp, (mant + 1) * 10.0 ** exp)
+
+    def record(self, value, count = 1):
+        bucket = self._bucket(value)
+        self._counts[bucket] = self._counts.get(bucket, 0) + count
+        self._count += count
+        self._total += value * count
+        self._min    = value if self._min is None else min(self._min, value)
+        self._max    = value if self._max is None else max(self._max, value)
+
+    def percentile(self, p):
+        if not self._count:
+            return None
+        rank = max(1, int(math.ceil(p / 100.0 * self._count)))
+        seen = 0
+        for bucket in sorted(self._counts.keys(), key = self._bounds):
+            seen += self._counts[bucket]
+            if seen >= rank:
+                lo, hi = self._bounds(bucket)
+                return min(max((lo + hi) / 2.0, self._min), self._max)
+        return self._max
+
+    def export(self):
+        """Serializable form, with the usual percentiles precomputed"""
+        buckets = sorted(self._counts.items(), key = lambda x : self._bounds(x[0]))
+        data    = dict(
+            digits  = self._digits,
+            count   = self._count,
+            total   = self._total,
+            min     = self._min,
+            max     = self._max,
+            buckets = [[m, e, n] for ((m, e), n) in buckets],
+        )
+        for p in PERCENTILES:
+            data['p%s' % (('%g' % (p,)).replace('.', '_'),)] = self.percentile(p)
+        return data
+
+    @staticmethod
+    def restore(data):
+        histogram = Histogram(data['digits'])
+        histogram._counts = dict(((m, e), n) for m, e, n in data['buckets'])
+        histogram._count  = data['count']
+        histogram._total  = data['total']
+        histogram._min    = data['min']
+        histogram._max    = data['max']
+        return histogram
+
+    @staticmethod
+    def of_samples(samples, digits = 3):
+        histogram = Histogram(digits)
+        for x in samples:
+            histogram.record(x)
+        return histogram
+
+# --------------------------------------------------------------------
+def summarize_latencies(results):
+    """
+    Replace the raw [hs_us] (resp. [call_us]) samples of [results] by
+    histograms, stored in [latency] (resp. [call_latency]).
+    """
+    for value in results.values():
+        for raw, name in (('hs_us', 'latency'), ('call_us', 'call_latency')):
+            samples = value.pop(raw, None)
+            if samples:
+                value[name] = Histogram.of_samples(samples).export()
+    return results
+
+# --------------------------------------------------------------------
+def find_knee(series, threshold = 0.05):
+    """
+    Saturation point of a load time series: the first concurrency level
+    whose mean throughput is less than [threshold] above the one of the
+    previous level. Returns None if throughput kept scaling.
+    """
+    levels = dict()
+    for sample in series:
+        levels.setdefault(sample['clients'], []).append(sample)
+
+    previous = None
+    for clients in sorted(levels.keys()):
+        samples = levels[clients]
+        hs      = sum([x['hs'] for x in samples]) / len(samples)
+        p99     = max([x['p99'] for x in samples if x['p99'] is not None] or [None])
+        if previous is not None and hs < previous[1] * (1 + threshold):
+            return dict(clients = clients, hs = hs, p99 = p99,
+                        previous = dict(clients = previous[0], hs = previous[1]))
+        previous = (clients, hs)
+
+    return None
+
+def summarize_load(results):
+    """Attach the saturation point to the load time series of [results]"""
+    for value in results.values():
+        if value.get('load'):
+            value['knee'] = find_knee(value['load'])
+    return results
+
+# --------------------------------------------------------------------
+class ProcSampler(threading.Thread):
+    """
+    Periodically sample the resident set size of a running process from
+    /proc/<pid>/status, complementing the (end-of-life) rusage of
+    os.wait4 with the RSS profile over time.
+    """
+
+    def __init__(self, pid, period = 0.1):
+        threading.Thread.__init__(self)
+        self.daemon   = True
+        self._pid     = pid
+        self._period  = period
+        self._stopped = threading.Event()
+        self._rss     = []
+
+    def run(self):
+        path = '/proc/%d/status' % (self._pid,)
+        while not self._stopped.is_set():
+            m = re.search(r'^VmRSS:\s*(\d+)\s*kB$', _read_sysfs(path, ''), re.M)
+            if m is None:
+                break
+            self._rss.append(int(m.group(1)))
+            self._stopped.wait(self._period)
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+        return dict(
+            rss_samples = len(self._rss),
+            rss_mean_kb = sum(self._rss) / len(self._rss) if self._rss else None,
+            rss_peak_kb = max(self._rss) if self._rss else None,
+        )
+
+# --------------------------------------------------------------------
+def wait_rusage(process):
+    """
+    Reap [process] (a subprocess.Popen) with os.wait4 and return its
+    resource usage. [process.returncode] is set as by process.wait().
+    """
+    while True:
+        try:
+            _, status, ru = os.wait4(process.pid, 0)
+            break
+        except OSError as e:
+            if e.errno != errno.EINTR:
+                raise
+
+    if os.WIFSIGNALED(status):
+        process.returncode = -os.WTERMSIG(status)
+    else:
+        process.returncode = os.WEXITSTATUS(status)
+
+    return dict(
+        user    = ru.ru_utime,
+        sys     = ru.ru_stime,
+        maxrss  = ru.ru_maxrss,         # kB on Linux
+        minflt  = ru.ru_minflt,
+        majflt  = ru.ru_majflt,
+        nvcsw   = ru.ru_nvcsw,
+        nivcsw  = ru.ru_nivcsw,
+    )
+
+# --------------------------------------------------------------------
+def cpu_hz():
+    """Nominal CPU frequency (from /proc/cpuinfo), or None"""
+    m = re.search(r'^cpu MHz\s*:\s*([\d.]+)$', _read_sysfs('/proc/cpuinfo', ''), re.M)
+    return None if m is None else float(m.group(1)) * 1e6
+
+def efficiency(results, usage):
+    """
+    Attach to each cipher result of [results] its work per unit of CPU,
+    where [usage] maps process names (client, server) to their rusage.
+    The CPU time (user + sys) is the one of the whole processes:
+      hs_per_cpu_s    handshakes (hs_count) per second of CPU
+      bytes_per_cycle application bytes per (nominal) CPU cycle
+    """
+    cpu = sum([x['user'] + x['sys'] for x in usage.values() if x is not None])
+    hz  = cpu_hz()
+
+    for value in results.values():
+        value['cpu_s'] = cpu
+        if not cpu:
+            continue
+        if 'hs_count' in value:
+            value['hs_per_cpu_s'] = value['hs_count'] / cpu
+        if 'bytes' in value and hz is not None:
+            value['bytes_per_cycle'] = value['bytes'] / (cpu * hz)
+
+    return results
+
+# --------------------------------------------------------------------
+def host_info():
+    topology = cpu_topology()
+
+    return dict(
+        hostname = socket.gethostname(),
+        platform = platform.platform(),
+        python   = platform.python_version(),
+        date     = time.strftime('%Y-%m-%dT%H:%M:%S'),
+        cpu_hz   = cpu_hz(),
+        topology = [x.__dict__ for x in topology],
+    )
+
+# --------------------------------------------------------------------
+class ResultStore(object):
+    """
+    Structured benchmark results: one JSON document holding the host
+    information and one record per measured configuration.
+    """
+
+    def __init__(self, filename, **meta):
+        self._filename = filename
+        self._meta     = host_info()
+        self._records  = []
+        self._meta.update(meta)
+
+    filename = property(lambda self : self._filename)
+    records  = property(lambda self : self._records[:])
+
+    def add(self, **record):
+        self._records.append(record)
+
+    def add_meta(self, **meta):
+        self._meta.update(meta)
+
+    def save(self):
+        if self._filename is None:
+            return
+        data = dict(meta = self._meta, results = self._records)
+        with open(self._filename, 'w') as stream:
+            json.dump(data, stream, indent = 2, sort_keys = True)
+            stream.write('\n')
+
+# --------------------------------------------------------------------
+def load_results(filename):
+    with open(filename, 'r') as stream:
+        return json.load(stream)
@@ -0,0 +1,227 @@
+#! /usr/bin/env python
+
+# --------------------------------------------------------------------
+# Bulk-transfer benchmark of apps/cmitls: cmitls.exe downloads files of
+# the given sizes over HTTPS from a local `openssl s_server -WWW' peer,
+# for each cipher suite, a number of times. Results are printed in the
+# bench clients format and can be stored as structured (JSON) results.
+
+# --------------------------------------------------------------------
+import sys, os, time, shutil, tempfile, subprocess as sp
+import benchlib
+
+# --------------------------------------------------------------------
+ROOT    = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+BIN     = os.path.join(ROOT, 'apps', 'cmitls', 'cmitls.exe')
+PKI     = os.path.join(ROOT, 'tests', 'pki', 'rsa')
+SERVER  = 'openssl s_server -quiet -WWW -accept %(port)d -cert %(cert)s -key %(key)s'
+PORT    = 4443
+REPEATS = 10
+SIZES   = (100000,)
+
+# --------------------------------------------------------------------
+def _libpaths():
+    """Same search path as apps/cmitls/Makefile"""
+    mitls     = os.environ.get('MITLS_HOME'    , ROOT)
+    mlcrypto  = os.environ.get('MLCRYPTO_HOME' , os.path.join(ROOT, '..', 'MLCrypto'))
+    evercrypt = os.environ.get('EVERCRYPT_HOME', os.path.join(ROOT, '..', 'hacl-star', 'providers'))
+
+    return [os.path.join(evercrypt, '..', 'dist', 'mitls'),
+            os.path.join(mitls, 'src', 'pki'),
+            os.path.join(mitls, 'src', 'tls', 'extract', 'Kremlin-Library'),
+            os.path.join(mlcrypto, 'openssl')]
+
+def _environ():
+    environ = os.environ.copy()
+    varname = 'DYLD_LIBRARY_PATH' if sys.platform == 'darwin' else 'LD_LIBRARY_PATH'
+    paths   = _libpaths() + [x for x in environ.get(varname, '').split(':') if x]
+    environ[varname] = ':'.join(paths)
+    return environ
+
+# --------------------------------------------------------------------
+def _options():
+    from optparse import OptionParser
+
+    parser = OptionParser(usage = '%prog [options]')
+
+    parser.add_option("-b", None,
+                      dest    = "binary",
+                      help    = "cmitls executable [%default]",
+                      metavar = "BIN",
+                      default = BIN)
+    parser.add_option("-c", None,
+                      action  = "append",
+                      dest    = "ciphers",
+                      help    = "cmitls cipher list (repeatable, default: cmitls default)",
+                      metavar = "CIPHERS",
+                      default = [])
+    parser.add_option("-v", None,
+                      dest    = "version",
+                      help    = "maximum TLS version, see cmitls -v [%default]",
+                      metavar = "VERSION",
+                      default = '1.3')
+    parser.add_option("-s", None,
+                      dest    = "sizes",
+                      help    = "comma-separated transfer sizes, in bytes [%s]" % \
+                                    (','.join(map(str, SIZES)),),
+                      metavar = "SIZES",
+                      default = None)
+    parser.add_option("-n", None,
+                      dest    = "repeats",
+                      help    = "number of runs per config [%default]",
+                      metavar = "N",
+                      type    = int,
+                      default = REPEATS)
+    parser.add_option("-P", None,
+                      dest    = "port",
+                      help    = "server TCP port [%default]",
+                      metavar = "PORT",
+                      type    = int,
+                      default = PORT)
+    parser.add_option("-k", None,
+                      dest    = "certname",
+                      help    = "server certificate name [%default]",
+                      metavar = "CERTNAME",
+                      default = 'rsa.cert-01.mitls.org')
+    parser.add_option("-S", None,
+                      dest    = "server",
+                      help    = "server command, %(port)d %(cert)s %(key)s are substituted",
+                      metavar = "SERVER",
+                      default = SERVER)
+    parser.add_option("-o", None,
+                      dest    = "output",
+                      help    = "write structured results to OUTPUT (JSON)",
+                      metavar = "OUTPUT",
+                      default = None)
+
+    (options, args) = parser.parse_args()
+
+    if args:
+        parser.error('no positional arguments expected')
+    if options.repeats < 1:
+        parser.error('N must be positive')
+
+    try:
+        sizes = SIZES if options.sizes is None else options.sizes.split(',')
+        options.sizes = [int(x) for x in sizes]
+    except ValueError:
+        parser.error('invalid transfer sizes: %s' % (options.sizes,))
+
+    options.ciphers = options.ciphers or [None]
+
+    return options
+
+# --------------------------------------------------------------------
+def _docroot(sizes):
+    """Temporary directory holding one file per transfer size"""
+    docroot = tempfile.mkdtemp(prefix = 'cmitls-bench-')
+    block   = os.urandom(64 * 1024)
+
+    for size in sizes:
+        with open(os.path.join(docroot, str(size)), 'wb') as stream:
+            for i in range(0, size, len(block)):
+                stream.write(block[:size-i])
+
+    return docroot
+
+# --------------------------------------------------------------------
+def _run_config(config, docroot, options):
+    environ = _environ()
+    certs   = os.path.join(PKI, 'certificates')
+    server  = options.server % dict(
+        port = options.port,
+        cert = os.path.join(certs, options.certname + '.crt'),
+        key  = os.path.join(certs, options.certname + '.key'))
+    command = [options.binary, '127.0.0.1', str(options.port), str(config.payload),
+               '-quiet', '-v', config.version]
+    if config.cipher != 'default':
+        command.extend(['-ciphers', config.cipher])
+
+    usage  = dict(client = dict(), server = None)
+    walls  = []
+    null   = open(os.devnull, 'w')
+    server = sp.Popen('exec ' + server, shell = True, cwd = docroot,
+                      stdout = null, stderr = sp.STDOUT)
+
+    try:
+        benchlib.wait_for_port(options.port, process = server)
+
+        for i in range(options.repeats):
+            start  = time.time()
+            client = sp.Popen(command, env = environ,
+                              stdout = null, stderr = sp.STDOUT)
+            ru     = benchlib.wait_rusage(client)
+            walls.append(time.time() - start)
+            if client.returncode != 0:
+                raise sp.CalledProcessError(client.returncode, ' '.join(command))
+            for k, v in ru.items():
+                if k == 'maxrss':
+                    usage['client'][k] = max(usage['client'].get(k, 0), v)
+                else:
+                    usage['client'][k] = usage['client'].get(k, 0) + v
+    finally:
+        if server.poll() is None:
+            server.terminate()
+            usage['server'] = benchlib.wait_rusage(server)
+        null.close()
+
+    wall    = sum(walls)
+    nbytes  = config.payload * options.repeats
+    results = { config.cipher : dict(
+        rate     = nbytes / (1024. * 1024.) / wall,
+        hs_count = options.repeats,
+        bytes    = nbytes,
+        runs     = walls,
+    ) }
+    results = benchlib.efficiency(results, usage)
+
+    return dict(
+        matrix   = config.matrix,
+        pki      = config.pki,
+        certname = config.certname,
+        cipher   = config.cipher,
+        version  = config.version,
+        payload  = config.payload,
+        port     = options.port,
+        wall     = wall,
+        usage    = usage,
+        results  = results,
+    )
+
+# --------------------------------------------------------------------
+def _main():
+    options = _options()
+
+    if not os.path.exists(options.binary):
+        print >>sys.stderr, "cannot find `%s' (make -C apps/cmitls)" % (options.binary,)
+        exit(1)
+
+    configs = [benchlib.Object(matrix   = 'cmitls',
+                               pki      = os.path.basename(PKI),
+                               certname = options.certname,
+                               cipher   = cipher or 'default',
+                               version  = options.version,
+                               payload  = size) \
+                   for cipher in options.ciphers for size in options.sizes]
+
+    store = benchlib.ResultStore(options.output,
+        client  = options.binary,
+        server  = options.server,
+        repeats = options.repeats)
+
+    docroot = _docroot(options.sizes)
+
+    try:
+        for config in configs:
+            record = _run_config(config, docroot, options)
+            store.add(**record)
+            print '%s: %.2f MiB/s # %d bytes' % \
+                (config.cipher, record['results'][config.cipher]['rate'], config.payload)
+            sys.stdout.flush()
+    finally:
+        shutil.rmtree(docroot, ignore_errors = True)
+        store.save()
+
+# --------------------------------------------------------------------
+if __name__ == '__main__':
+    _main()
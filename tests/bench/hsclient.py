@@ -0,0 +1,70 @@
+#! /usr/bin/env python
+
+# --------------------------------------------------------------------
+# Python stand-in for the bench clients: performs HSCOUNT handshakes
+# against the server listening on PORT and times each of them. Takes
+# its configuration from the environment, as openssl-client does.
+
+# --------------------------------------------------------------------
+import sys, os, time, socket, ssl
+import benchlib
+
+# --------------------------------------------------------------------
+HSCOUNT = 250
+
+# --------------------------------------------------------------------
+def _context(pki, cipher):
+    context = benchlib.ssl_context(cipher)
+    if pki is not None:
+        capath = os.path.join(pki, 'db', 'ca.db.certs')
+        if os.path.isdir(capath):
+            context.load_verify_locations(capath = capath)
+    return context
+
+# --------------------------------------------------------------------
+def _handshake(context, port):
+    sock = socket.create_connection(('127.0.0.1', port))
+    try:
+        start = time.time()
+        tls   = context.wrap_socket(sock)
+        tls.sendall(b'\x00')
+        stop  = time.time()
+        try:
+            tls.unwrap()
+        except (ssl.SSLError, socket.error):
+            pass
+    finally:
+        sock.close()
+    return stop - start
+
+# --------------------------------------------------------------------
+def _main():
+    cipher  = os.environ.get('CIPHERSUITE', None)
+    port    = int(os.environ.get('PORT', 5000))
+    count   = int(os.environ.get('HSCOUNT', HSCOUNT))
+    hstimes = 'HSTIMES' in os.environ
+
+    if cipher is None:
+        print >>sys.stderr, 'no cipher suite given'
+        exit(1)
+
+    try:
+        context = _context(os.environ.get('PKI', None), cipher)
+    except ValueError as e:
+        print >>sys.stderr, e
+        exit(1)
+    ticks   = []
+
+    for i in range(count + 1):
+        tick = _handshake(context, port)
+        if i != 0:              # First handshake is a warm-up
+            ticks.append(tick)
+            if hstimes:
+                print '%s: %.2f us/HS' % (cipher, tick * 1000000)
+
+    print '%s: %d HS' % (cipher, count + 1)
+    print '%s: %.2f HS/s' % (cipher, len(ticks) / sum(ticks))
+
+# --------------------------------------------------------------------
+if __name__ == '__main__':
+    _main()
@@ -0,0 +1,178 @@
+#! /usr/bin/env python
+
+# --------------------------------------------------------------------
+# Load-profile client: drives a varying number of concurrent
+# connections (handshake + PAYLOAD bytes each) against the server
+# listening on PORT, following the stages given in LOADPROFILE, and
+# prints one `<cipher>: load {...}' record per INTERVAL seconds.
+#
+# LOADPROFILE is a comma-separated list of stages:
+#   <n>x<secs>[@<rate>]      n concurrent clients during secs seconds,
+#                            optionally capped at rate connections/s
+#   <n>-<m>x<secs>[@<rate>]  ramp: n, 2n, 4n, ... up to m clients,
+#                            secs seconds each
+# e.g. `1-64x5,64x30@400'
+
+# --------------------------------------------------------------------
+import sys, os, re, time, json, socket, ssl, threading
+import benchlib
+
+# --------------------------------------------------------------------
+PROFILE  = '1-32x5'
+INTERVAL = 1.0
+
+# --------------------------------------------------------------------
+def parse_profile(spec):
+    stages = []
+
+    for item in [x.strip() for x in spec.split(',') if x.strip()]:
+        m = re.search(r'^(\d+)(?:-(\d+))?x(\d+(?:\.\d+)?)(?:@(\d+(?:\.\d+)?))?$', item)
+        if m is None:
+            raise ValueError('invalid load stage: %s' % (item,))
+        lo   = int(m.group(1))
+        hi   = lo if m.group(2) is None else int(m.group(2))
+        secs = float(m.group(3))
+        rate = None if m.group(4) is None else float(m.group(4))
+
+        if lo < 1 or hi < lo:
+            raise ValueError('invalid load stage: %s' % (item,))
+
+        while True:
+            stages.append(benchlib.Object(clients = min(lo, hi), duration = secs, rate = rate))
+            if lo >= hi: break
+            lo *= 2
+
+    return stages
+
+# --------------------------------------------------------------------
+class Pacer(object):
+    """Token bucket shared by the workers of a rate-capped stage"""
+
+    def __init__(self, rate):
+        self._lock  = threading.Lock()
+        self._delta = 1.0 / rate
+        self._next  = time.time()
+
+    def wait(self):
+        with self._lock:
+            now        = time.time()
+            self._next = max(self._next, now - self._delta) + self._delta
+            delay      = self._next - now
+        if delay > 0:
+            time.sleep(delay)
+
+# --------------------------------------------------------------------
+class LoadGenerator(object):
+    def __init__(self, context, port, payload):
+        self._context = context
+        self._port    = port
+        self._payload = b'\x00' * max(payload, 1)
+        self._lock    = threading.Lock()
+        self._events  = []
+
+    def _connection(self):
+        start = time.time()
+        sock  = socket.create_connection(('127.0.0.1', self._port))
+        try:
+            tls = self._context.wrap_socket(sock)
+            tls.sendall(self._payload)
+            try:
+                tls.unwrap()
+            except (ssl.SSLError, socket.error):
+                pass
+        finally:
+            sock.close()
+        return time.time() - start
+
+    def _worker(self, deadline, pacer, stage):
+        while time.time() < deadline:
+            if pacer is not None:
+                pacer.wait()
+            start = time.time()
+            try:
+                latency, ok = self._connection(), True
+            except (ssl.SSLError, socket.error):
+                latency, ok = time.time() - start, False
+            with self._lock:
+                self._events.append((time.time(), latency, ok, stage))
+
+    def run(self, stages):
+        origin = time.time()
+
+        for i, stage in enumerate(stages):
+            deadline = time.time() + stage.duration
+            pacer    = None if stage.rate is None else Pacer(stage.rate)
+            threads  = [threading.Thread(target = self._worker,
+                                         args   = (deadline, pacer, i)) \
+                            for _ in range(stage.clients)]
+            for thread in threads:
+                thread.daemon = True
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        return (origin, self._events[:])
+
+# --------------------------------------------------------------------
+def time_series(origin, events, stages, payload, interval = INTERVAL):
+    """Bucket the completed connections into [interval]-long samples"""
+    buckets = dict()
+
+    for stamp, latency, ok, stage in events:
+        key = int((stamp - origin) / interval)
+        buckets.setdefault(key, []).append((latency, ok, stage))
+
+    series = []
+    for key in sorted(buckets.keys()):
+        items     = buckets[key]
+        done      = [x[0] * 1000000 for x in items if x[1]]
+        histogram = benchlib.Histogram.of_samples(done)
+        series.append(dict(
+            t       = key * interval,
+            clients = stages[max([x[2] for x in items])].clients,
+            hs      = len(done) / interval,
+            errors  = len([x for x in items if not x[1]]),
+            mib     = len(done) * max(payload, 1) / interval / (1024. * 1024.),
+            p50     = histogram.percentile(50.0),
+            p99     = histogram.percentile(99.0),
+        ))
+
+    return series
+
+# --------------------------------------------------------------------
+def _main():
+    cipher  = os.environ.get('CIPHERSUITE', None)
+    port    = int(os.environ.get('PORT', 5000))
+    payload = int(os.environ.get('PAYLOAD', 0))
+
+    if cipher is None:
+        print >>sys.stderr, 'no cipher suite given'
+        exit(1)
+
+    try:
+        stages = parse_profile(os.environ.get('LOADPROFILE', PROFILE))
+    except ValueError as e:
+        print >>sys.stderr, e
+        exit(1)
+
+    try:
+        context = benchlib.ssl_context(cipher)
+    except ValueError as e:
+        print >>sys.stderr, e
+        exit(1)
+
+    origin, events = LoadGenerator(context, port, payload).run(stages)
+
+    for sample in time_series(origin, events, stages, payload):
+        print '%s: load %s' % (cipher, json.dumps(sample, sort_keys = True))
+
+    done = [x for x in events if x[2]]
+    print '%s: %d HS' % (cipher, len(done))
+    print '%s: %d bytes' % (cipher, len(done) * max(payload, 1))
+    if events:
+        span = max([x[0] for x in events]) - origin
+        print '%s: %.2f HS/s' % (cipher, len(done) / span if span > 0 else 0.)
+
+# --------------------------------------------------------------------
+if __name__ == '__main__':
+    _main()
@@ -117,6 +117,8 @@ static const ciphername_t ciphernames[] = {
   { "TLS_RSA_WITH_AES_128_CBC_SHA256"    , "AES128-SHA256"          },
   { "TLS_RSA_WITH_AES_256_CBC_SHA"       , "AES256-SHA"             },
   { "TLS_RSA_WITH_AES_256_CBC_SHA256"    , "AES256-SHA256"          },
+  { "TLS_RSA_WITH_AES_128_GCM_SHA256"    , "AES128-GCM-SHA256"      },
+  { "TLS_RSA_WITH_AES_256_GCM_SHA384"    , "AES256-GCM-SHA384"      },
   { "TLS_DH_anon_WITH_3DES_EDE_CBC_SHA"  , "ADH-DES-CBC3-SHA"       },
   { "TLS_DH_anon_WITH_AES_128_CBC_SHA"   , "ADH-AES128-SHA"         },
   { "TLS_DH_anon_WITH_AES_128_CBC_SHA256", "ADH-AES128-SHA256"      },
@@ -163,6 +165,28 @@ static const char* get_cs_fullname(const char *csname) {
 static const int zero = 0;
 static const int one  = 1;
 
+static unsigned short get_port(void) {
+    const char *port = getenv("PORT");
+    return (port == NULL) ? 5000 : (unsigned short) atoi(port);
+}
+
+/* Bytes sent over the data connection */
+static size_t get_payload(void) {
+    const char *payload = getenv("PAYLOAD");
+    return (payload == NULL) ? TOSEND : (size_t) strtoull(payload, NULL, 10);
+}
+
+static tlsver_t get_tlsver(void) {
+    const char *name = getenv("TLSVERSION");
+    tlsver_t    version;
+
+    if (name == NULL)
+        return TLS_1p2;
+    if ((version = tlsver_of_name(name)) == (tlsver_t) -1)
+        i_error("unknown/unsupported TLS version");
+    return version;
+}
+
 /* -------------------------------------------------------------------- */
 void client(SSL_CTX *sslctx, const struct echossl_s *options) {
 #define BLKSZ (256 * 1024u)
@@ -173,19 +197,24 @@ void client(SSL_CTX *sslctx, const struct echossl_s *options) {
 
     SSL *ssl = NULL;
 
-    size_t sent = 0;
-    size_t upos = 0;
+    size_t sent   = 0;
+    size_t upos   = 0;
+    size_t tosend = get_payload();
 
     struct timeval tv1;
     struct timeval tv2;
 
-    unsigned hsdone  = 0;
+    unsigned hsdone  = 0;       /* Timed handshakes */
+    unsigned hstotal = 0;       /* All handshakes, warm-up included */
     double   hsticks = 0;
 
+    /* Emit one timing record per handshake */
+    int hstimes = getenv("HSTIMES") != NULL;
+
     memset(&peername, 0, sizeof(in4_t));
     peername.sin_family = AF_INET;
     peername.sin_addr   = (struct in_addr) { .s_addr = htonl(INADDR_LOOPBACK) };
-    peername.sin_port   = htons(5000);
+    peername.sin_port   = htons(get_port());
 
     for (i = 0; i < 250; ++i) {
         uint8_t byte[1] = { 0x00 };
@@ -205,6 +234,7 @@ void client(SSL_CTX *sslctx, const struct echossl_s *options) {
            occurred. */
         if ((rr = SSL_connect(ssl)) <= 0)
             s_error(ERR_get_error(), "SSL connect failed");
+        hstotal += 1;
 
         if (SSL_write(ssl, byte, 1) <= 0)
             s_error(ERR_get_error(), "SSL write (HS) failed");
@@ -221,7 +251,11 @@ void client(SSL_CTX *sslctx, const struct echossl_s *options) {
         if (i != 0) {
             hsdone  += 1;
             hsticks += (tv2_d - tv1_d);
-            
+
+            if (hstimes)
+                printf("%s: %.2f us/HS\n",
+                       get_cs_fullname(options->ciphers),
+                       (tv2_d - tv1_d) * 1000000);
         }
     }
 
@@ -242,13 +276,16 @@ void client(SSL_CTX *sslctx, const struct echossl_s *options) {
     (void) SSL_set_fd(ssl, fd);
     if ((rr = SSL_connect(ssl)) <= 0)
         s_error(ERR_get_error(), "SSL connect failed");
+    hstotal += 1;
 
     (void) gettimeofday(&tv1, NULL);
 
-    while (sent < TOSEND) {
-        if (sizeof(udata) - upos < BLKSZ)
+    while (sent < tosend) {
+        size_t blksz = (tosend - sent < BLKSZ) ? (tosend - sent) : BLKSZ;
+
+        if (sizeof(udata) - upos < blksz)
             upos = 0;
-        if ((rr = SSL_write(ssl, &udata[upos], BLKSZ)) <= 0)
+        if ((rr = SSL_write(ssl, &udata[upos], blksz)) <= 0)
             s_error(ERR_get_error(), "client-side write failed");
         sent += rr;
         upos += rr;
@@ -279,6 +316,8 @@ void client(SSL_CTX *sslctx, const struct echossl_s *options) {
     printf("%s: %.2f MiB/s\n",
            get_cs_fullname(options->ciphers),
            (sent / ((double) (1024 * 1024))) / (tv2_d - tv1_d));
+    printf("%s: %u HS\n", get_cs_fullname(options->ciphers), hstotal);
+    printf("%s: %zu bytes\n", get_cs_fullname(options->ciphers), sent);
 
     (void) closesocket(fd);
 }
@@ -305,7 +344,7 @@ int main(void) {
     options.sname   = NULL;
     options.cname   = NULL;
     options.pki     = getenv("PKI");
-    options.tlsver  = TLS_1p2;
+    options.tlsver  = get_tlsver();
 
     if (options.ciphers == NULL)
         i_error("no cipher suite given");
@@ -61,6 +61,22 @@ static void s_error(unsigned long e, const char *message) {
 static const int zero = 0;
 static const int one  = 1;
 
+static unsigned short get_port(void) {
+    const char *port = getenv("PORT");
+    return (port == NULL) ? 5000 : (unsigned short) atoi(port);
+}
+
+static tlsver_t get_tlsver(void) {
+    const char *name = getenv("TLSVERSION");
+    tlsver_t    version;
+
+    if (name == NULL)
+        return TLS_1p2;
+    if ((version = tlsver_of_name(name)) == (tlsver_t) -1)
+        i_error("unknown/unsupported TLS version");
+    return version;
+}
+
 int listener(void) {
     int   servfd = -1;
     in4_t sockname;
@@ -72,7 +88,7 @@ int listener(void) {
     memset(&sockname, 0, sizeof(in4_t));
     sockname.sin_family = AF_INET;
     sockname.sin_addr   = (struct in_addr) { .s_addr = INADDR_ANY };
-    sockname.sin_port   = htons(5000);
+    sockname.sin_port   = htons(get_port());
 
     setsockopt(servfd, SOL_SOCKET, SO_REUSEADDR, (void*) &one, sizeof(one));
 
@@ -158,7 +174,7 @@ int main(void) {
     options.sname   = getenv("CERTNAME");
     options.cname   = NULL;
     options.pki     = getenv("PKI");
-    options.tlsver  = TLS_1p2;
+    options.tlsver  = get_tlsver();
 
     if (options.pki == NULL)
         i_error("no PKI directory given");
@@ -0,0 +1,257 @@
+# --------------------------------------------------------------------
+# Profiler hooks for the benchmark drivers: wrap the measured command in
+# a profiler, then turn its output into collapsed stacks (one
+# `frame;frame;...;frame <weight>' line per stack) and a flamegraph.
+#
+#   perf      perf record -g (native clients)
+#   mono      mono --profile=log (.NET clients, e.g. BenchClient.exe)
+#   cprofile  python -m cProfile (Python stand-ins)
+#   auto      pick one of the above from the command
+
+# --------------------------------------------------------------------
+import sys, os, re, shlex, pipes, cgi, pstats, subprocess as sp
+
+# --------------------------------------------------------------------
+KINDS = ('auto', 'perf', 'mono', 'cprofile')
+
+# --------------------------------------------------------------------
+def _which(name):
+    for path in os.environ.get('PATH', '').split(os.pathsep):
+        candidate = os.path.join(path, name)
+        if os.path.isfile(candidate) and os.access(candidate, os.X_OK):
+            return candidate
+    return None
+
+def _is_dotnet(filename):
+    """Whether [filename] is a PE image (i.e. needs mono on Unix)"""
+    try:
+        with open(filename, 'rb') as stream:
+            return stream.read(2) == b'MZ'
+    except (IOError, OSError):
+        return False
+
+# --------------------------------------------------------------------
+def kind_of_command(command):
+    argv = shlex.split(command)
+    head = os.path.basename(argv[0]) if argv else ''
+
+    if head.startswith('python') or head.endswith('.py'):
+        return 'cprofile'
+    if head == 'mono' or (head.endswith('.exe') and _is_dotnet(argv[0])):
+        return 'mono'
+    return 'perf'
+
+# --------------------------------------------------------------------
+def wrap(kind, command, prefix):
+    """
+    Return [command] (a shell command) run under the profiler [kind],
+    storing its raw output under the path [prefix].
+    """
+    argv = shlex.split(command)
+
+    if kind == 'perf':
+        argv = ['perf', 'record', '-q', '-g', '-o', prefix + '.perf.data', '--'] + argv
+
+    elif kind == 'mono':
+        option = '--profile=log:sample,output=%s.mlpd' % (prefix,)
+        if os.path.basename(argv[0]) == 'mono':
+            argv = argv[:1] + [option] + argv[1:]
+        else:
+            argv = ['mono', option] + argv
+
+    elif kind == 'cprofile':
+        option = ['-m', 'cProfile', '-o', prefix + '.pstats']
+        if os.path.basename(argv[0]).startswith('python'):
+            argv = argv[:1] + option + argv[1:]
+        else:
+            argv = [sys.executable] + option + argv
+
+    else:
+        raise ValueError('unknown profiler: %s' % (kind,))
+
+    return ' '.join([pipes.quote(x) for x in argv])
+
+# --------------------------------------------------------------------
+def _collapse_perf(datafile):
+    """Collapsed stacks of a `perf record -g' output (via perf script)"""
+    script = sp.Popen(['perf', 'script', '-i', datafile],
+                      stdout = sp.PIPE, stderr = open(os.devnull, 'w'))
+    stacks = dict()
+    frames = None
+
+    def flush():
+        if frames:
+            key = ';'.join(reversed(frames))
+            stacks[key] = stacks.get(key, 0) + 1
+
+    for line in script.stdout:
+        line = line.rstrip()
+        if not line:
+            flush()
+            frames = None
+        elif not line[0].isspace():
+            flush()
+            frames = []
+        elif frames is not None:
+            m = re.search(r'^\s*[0-9a-f]+\s+(.*?)(?:\+0x[0-9a-f]+)?\s+\((.*)\)$', line)
+            if m is not None:
+                name = m.group(1)
+                frames.append(name if name != '[unknown]' else os.path.basename(m.group(2)))
+    flush()
+    script.wait()
+
+    return stacks
+
+# --------------------------------------------------------------------
+def _collapse_pstats(statsfile, maxdepth = 64, maxpaths = 100000):
+    """
+    Approximate collapsed stacks of a cProfile output. cProfile only
+    keeps caller->callee edges, so the time of a function is split among
+    its callees in proportion of the edge cumulative times.
+
+    The number of call paths grows exponentially with shared callees:
+    subtrees of less than a microsecond (the output unit) are not
+    walked, and no more than [maxpaths] paths are. The time of a
+    subtree that is not walked is charged to its root.
+    """
+    stats  = pstats.Stats(statsfile).stats
+    stacks = dict()
+    walked = [0]
+
+    def name(func):
+        filename, lineno, fname = func
+        return '%s:%d(%s)' % (os.path.basename(filename), lineno, fname)
+
+    callees = dict()
+    for func, (_, _, _, _, callers) in stats.items():
+        for caller, edge in callers.items():
+            callees.setdefault(caller, []).append((func, edge[3]))
+
+    def walk(func, budget, path):
+        _, _, tt, ct, _ = stats[func]
+        walked[0] += 1
+        path  = path + [name(func)]
+        share = budget / ct if ct else 0.
+        own   = tt * share
+        calls = [(callee, edgect * share) for callee, edgect in callees.get(func, []) \
+                     if name(callee) not in path]
+        if len(path) >= maxdepth or walked[0] >= maxpaths:
+            own, calls = budget, []
+        else:
+            own  += sum([x for _, x in calls if x < 1e-6])
+            calls = [(callee, x) for callee, x in calls if x >= 1e-6]
+        if own > 0:
+            key = ';'.join(path)
+            stacks[key] = stacks.get(key, 0) + own
+        for callee, x in calls:
+            walk(callee, x, path)
+
+    for func, (_, _, _, ct, callers) in stats.items():
+        if not callers:
+            walk(func, ct, [])
+
+    # Weights are in microseconds
+    return dict((k, int(v * 1000000)) for k, v in stacks.items() if int(v * 1000000))
+
+# --------------------------------------------------------------------
+def write_collapsed(stacks, filename):
+    with open(filename, 'w') as stream:
+        for key in sorted(stacks.keys()):
+            stream.write('%s %d\n' % (key, stacks[key]))
+
+# --------------------------------------------------------------------
+def flamegraph(stacks, title, filename, width = 1200, height = 16):
+    """
+    Render collapsed [stacks] as an SVG flamegraph. Uses flamegraph.pl
+    (FLAMEGRAPH or PATH) when available, and a minimal renderer
+    otherwise.
+    """
+    tool = os.environ.get('FLAMEGRAPH', None) or _which('flamegraph.pl')
+
+    if tool is not None:
+        collapsed = ''.join(['%s %d\n' % (k, v) for k, v in stacks.items()])
+        with open(filename, 'w') as stream:
+            proc = sp.Popen([tool, '--title', title], stdin = sp.PIPE, stdout = stream)
+            proc.communicate(collapsed)
+        if proc.returncode == 0:
+            return
+
+    root = dict(name = 'all', value = 0, children = dict())
+    for key, value in stacks.items():
+        node = root
+        node['value'] += value
+        for frame in key.split(';'):
+            node = node['children'].setdefault(frame,
+                       dict(name = frame, value = 0, children = dict()))
+            node['value'] += value
+
+    rects = []
+    def layout(node, x, depth):
+        rects.append((node, x, depth))
+        for child in sorted(node['children'].values(), key = lambda n : n['name']):
+            layout(child, x, depth + 1)
+            x += child['value']
+    layout(root, 0, 0)
+
+    total  = float(root['value'] or 1)
+    depth  = max([x[2] for x in rects]) + 1
+    output = ['<svg xmlns="http://www.w3.org/2000/svg" width="%d" height="%d" '
+              'font-family="monospace" font-size="11">' % (width, (depth + 2) * height),
+              '<text x="%d" y="%d" text-anchor="middle">%s</text>' % \
+                  (width // 2, height, cgi.escape(title))]
+
+    for node, x, level in rects:
+        w = node['value'] / total * width
+        if w < 0.5:
+            continue
+        y     = (depth - level + 1) * height
+        label = '%s (%.2f%%)' % (node['name'], 100. * node['value'] / total)
+        hue   = 20 + (hash(node['name']) % 40)
+        output.append('<g><title>%s</title>'
+                      '<rect x="%.1f" y="%d" width="%.1f" height="%d" '
+                      'fill="hsl(%d,90%%,60%%)" stroke="white"/>' % \
+                          (cgi.escape(label), x / total * width, y, w, height - 1, hue))
+        if w > 7 * 4:
+            text = node['name'][:int(w / 7) - 1]
+            output.append('<text x="%.1f" y="%d">%s</text>' % \
+                              (x / total * width + 2, y + height - 4, cgi.escape(text)))
+        output.append('</g>')
+
+    output.append('</svg>')
+    with open(filename, 'w') as stream:
+        stream.write('\n'.join(output) + '\n')
+
+# --------------------------------------------------------------------
+def collect(kind, prefix, title):
+    """
+    Post-process the raw output of the profiler [kind] stored under
+    [prefix]. Return the artifacts produced (name -> path).
+    """
+    artifacts = dict()
+    stacks    = None
+
+    if kind == 'perf' and os.path.exists(prefix + '.perf.data'):
+        artifacts['raw'] = prefix + '.perf.data'
+        stacks = _collapse_perf(prefix + '.perf.data')
+
+    elif kind == 'cprofile' and os.path.exists(prefix + '.pstats'):
+        artifacts['raw'] = prefix + '.pstats'
+        stacks = _collapse_pstats(prefix + '.pstats')
+
+    elif kind == 'mono' and os.path.exists(prefix + '.mlpd'):
+        # The log profiler output has no stack-collapsing tooling; keep
+        # the raw trace and mprof-report's textual summary.
+        artifacts['raw'] = prefix + '.mlpd'
+        if _which('mprof-report') is not None:
+            with open(prefix + '.report.txt', 'w') as stream:
+                sp.call(['mprof-report', '--reports=sample,call,alloc',
+                         prefix + '.mlpd'], stdout = stream)
+            artifacts['report'] = prefix + '.report.txt'
+
+    if stacks:
+        write_collapsed(stacks, prefix + '.collapsed')
+        flamegraph(stacks, title, prefix + '.svg')
+        artifacts['collapsed'] = prefix + '.collapsed'
+        artifacts['flamegraph'] = prefix + '.svg'
+
+    return artifacts
@@ -0,0 +1,204 @@
+#! /usr/bin/env python
+
+# --------------------------------------------------------------------
+# QUIC handshake benchmark of apps/quicMinusNet: the in-memory
+# client/server handshakes of quic.exe (FFI_mitls_quic_create/process),
+# for each cipher suite. Two modes:
+#
+#   loop     `quic.exe bench': HSCOUNT handshakes per process, timed
+#            in-process, with the latency of each process call
+#   repeat   `quic.exe': one handshake per process, timed from the
+#            outside (process startup and trace included)
+#
+# Results are printed in the bench clients format and can be stored
+# as structured (JSON) results, next to the TLS ones.
+
+# --------------------------------------------------------------------
+import sys, os, time, subprocess as sp
+import benchlib
+
+# --------------------------------------------------------------------
+ROOT    = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+BIN     = os.path.join(ROOT, 'apps', 'quicMinusNet', 'quic.exe')
+CIPHERS = ('TLS_AES_128_GCM_SHA256', 'TLS_CHACHA20_POLY1305_SHA256')
+MODES   = ('loop', 'repeat')
+HSCOUNT = 100
+REPEATS = 5
+
+# --------------------------------------------------------------------
+def _libpaths():
+    """Same search path as apps/quicMinusNet/Makefile"""
+    mitls     = os.environ.get('MITLS_HOME'    , ROOT)
+    hacl      = os.environ.get('HACL_HOME'     , os.path.join(ROOT, '..', 'hacl-star'))
+    mlcrypto  = os.environ.get('MLCRYPTO_HOME' , os.path.join(ROOT, '..', 'MLCrypto'))
+    evercrypt = os.environ.get('EVERCRYPT_HOME', os.path.join(hacl, 'providers'))
+
+    return [os.path.join(evercrypt, '..', 'dist', 'mitls'),
+            os.path.join(mitls, 'src', 'pki'),
+            os.path.join(mitls, 'src', 'tls', 'extract', 'Kremlin-Library'),
+            os.path.join(hacl, 'providers', 'quic_provider'),
+            os.path.join(mlcrypto, 'openssl')]
+
+def _environ(**extra):
+    environ = os.environ.copy()
+    varname = 'DYLD_LIBRARY_PATH' if sys.platform == 'darwin' else 'LD_LIBRARY_PATH'
+    paths   = _libpaths() + [x for x in environ.get(varname, '').split(':') if x]
+    environ[varname] = ':'.join(paths)
+    environ.update(extra)
+    return environ
+
+# --------------------------------------------------------------------
+def _options():
+    from optparse import OptionParser
+
+    parser = OptionParser(usage = '%prog [options]')
+
+    parser.add_option("-b", None,
+                      dest    = "binary",
+                      help    = "quic executable [%default]",
+                      metavar = "BIN",
+                      default = BIN)
+    parser.add_option("-c", None,
+                      action  = "append",
+                      dest    = "ciphers",
+                      help    = "TLS 1.3 cipher suite (repeatable) [%s]" % (','.join(CIPHERS),),
+                      metavar = "CIPHER",
+                      default = [])
+    parser.add_option("-m", None,
+                      dest    = "mode",
+                      help    = "benchmark mode [%s] [%%default]" % ('|'.join(MODES),),
+                      metavar = "MODE",
+                      choices = MODES,
+                      default = 'loop')
+    parser.add_option("-n", None,
+                      dest    = "hscount",
+                      help    = "handshakes per process, loop mode [%default]",
+                      metavar = "N",
+                      type    = int,
+                      default = HSCOUNT)
+    parser.add_option("-r", None,
+                      dest    = "repeats",
+                      help    = "number of processes per cipher [%default]",
+                      metavar = "N",
+                      type    = int,
+                      default = REPEATS)
+    parser.add_option("-o", None,
+                      dest    = "output",
+                      help    = "write structured results to OUTPUT (JSON)",
+                      metavar = "OUTPUT",
+                      default = None)
+
+    (options, args) = parser.parse_args()
+
+    if args:
+        parser.error('no positional arguments expected')
+    if options.repeats < 1 or options.hscount < 1:
+        parser.error('N must be positive')
+
+    options.ciphers = options.ciphers or list(CIPHERS)
+
+    return options
+
+# --------------------------------------------------------------------
+def _add_usage(total, ru):
+    for k, v in ru.items():
+        if k == 'maxrss':
+            total[k] = max(total.get(k, 0), v)
+        else:
+            total[k] = total.get(k, 0) + v
+
+# --------------------------------------------------------------------
+def _run_config(config, options):
+    """
+    Run the quic binary [options.repeats] times for [config]. In loop
+    mode, the per-process outputs are merged; in repeat mode, each
+    process counts for one handshake of its wall time.
+    """
+    usage   = dict(client = dict(), server = None)
+    walls   = []
+    merged  = dict(HS = [], hs_us = [], call_us = [], hs_count = 0)
+    environ = _environ(CIPHERSUITE = config.cipher,
+                       HSCOUNT     = str(options.hscount),
+                       HSTIMES     = '1')
+    command = [options.binary] + (['bench'] if options.mode == 'loop' else [])
+
+    for i in range(options.repeats):
+        start  = time.time()
+        client = sp.Popen(command, env = environ,
+                          cwd    = os.path.dirname(os.path.abspath(options.binary)),
+                          stdout = sp.PIPE, stderr = sp.STDOUT)
+        output = client.stdout.read()
+        ru     = benchlib.wait_rusage(client)
+        walls.append(time.time() - start)
+        if client.returncode != 0:
+            raise sp.CalledProcessError(client.returncode, ' '.join(command))
+        _add_usage(usage['client'], ru)
+
+        if options.mode == 'loop':
+            result = benchlib.parse_client_output(output).get(config.cipher, {})
+            merged['HS'].append(result.get('HS', 0.))
+            merged['hs_us'].extend(result.get('hs_us', []))
+            merged['call_us'].extend(result.get('call_us', []))
+            merged['hs_count'] += result.get('hs_count', 0)
+        else:
+            merged['hs_us'].append(walls[-1] * 1000000)
+            merged['hs_count'] += 1
+
+    if options.mode == 'loop':
+        merged['HS'] = sum(merged['HS']) / len(merged['HS'])
+    else:
+        merged['HS'] = len(walls) / sum(walls)
+
+    results = { config.cipher : merged }
+    results = benchlib.summarize_latencies(results)
+    results = benchlib.efficiency(results, usage)
+
+    return dict(
+        matrix   = config.matrix,
+        pki      = config.pki,
+        certname = config.certname,
+        cipher   = config.cipher,
+        version  = config.version,
+        payload  = config.payload,
+        wall     = sum(walls),
+        usage    = usage,
+        results  = results,
+    )
+
+# --------------------------------------------------------------------
+def _main():
+    options = _options()
+
+    if not os.path.exists(options.binary):
+        print >>sys.stderr, "cannot find `%s' (make -C apps/quicMinusNet)" % (options.binary,)
+        exit(1)
+
+    configs = [benchlib.Object(matrix   = 'quic-' + options.mode,
+                               pki      = 'data',
+                               certname = 'server-ecdsa',
+                               cipher   = cipher,
+                               version  = 'TLS_1p3',
+                               payload  = None) \
+                   for cipher in options.ciphers]
+
+    store = benchlib.ResultStore(options.output,
+        client  = options.binary,
+        mode    = options.mode,
+        hscount = options.hscount if options.mode == 'loop' else 1,
+        repeats = options.repeats)
+
+    try:
+        for config in configs:
+            record = _run_config(config, options)
+            result = record['results'][config.cipher]
+            store.add(**record)
+            print '%s: %.2f HS/s' % (config.cipher, result['HS'])
+            if 'call_latency' in result:
+                print '%s: %.2f us/call # p50' % (config.cipher, result['call_latency']['p50'])
+            sys.stdout.flush()
+    finally:
+        store.save()
+
+# --------------------------------------------------------------------
+if __name__ == '__main__':
+    _main()
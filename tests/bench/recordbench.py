@@ -0,0 +1,378 @@
+#! /usr/bin/env python
+
+# --------------------------------------------------------------------
+# Record-layer microbenchmarks: encrypt/decrypt throughput of the TLS
+# record protections across fragment sizes, without sockets.
+#
+# The fixtures are the known-answer vectors of
+# src/tls/record-testvectors.txt (checked before anything is timed),
+# completed by TLS 1.3-style AEAD records (nonce = iv ^ seqn) for each
+# AEAD algorithm. Backends:
+#
+#   cryptography  the `cryptography' package (reference)
+#   quiccrypto    miTLS' libquiccrypto (quic_crypto_*), TLS 1.3 AEADs only
+#
+# `cryptography' may only be available to Python 3: this script runs
+# under both.
+
+# --------------------------------------------------------------------
+from __future__ import print_function
+
+import sys, os, re, time, struct, hmac, hashlib, binascii, ctypes
+import benchlib
+
+# --------------------------------------------------------------------
+ROOT     = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+VECTORS  = os.path.join(ROOT, 'src', 'tls', 'record-testvectors.txt')
+SIZES    = (16, 256, 1024, 4096, 16384)
+DURATION = 0.25
+AEADS    = ('AES_128_GCM', 'AES_256_GCM', 'CHACHA20_POLY1305')
+KEYLEN   = dict(AES_128_GCM = 16, AES_256_GCM = 32, CHACHA20_POLY1305 = 32)
+TAGLEN   = 16
+
+# --------------------------------------------------------------------
+def _unhex(x):
+    return binascii.unhexlify(x)
+
+def load_vectors(filename = VECTORS):
+    """
+    Parse the record test vectors: one `<title>\\n-----' section per
+    vector, holding the Keys, Plain and Cipher objects.
+    """
+    with open(filename, 'r') as stream:
+        contents = stream.read()
+
+    vectors  = []
+    sections = re.split(r'^(.+)\n-+\s*$', contents, flags = re.M)
+
+    for title, body in zip(sections[1::2], sections[2::2]):
+        objects = dict()
+        for name, fields in re.findall(r'(\w+):\s*\{(.*?)\}', body, re.S):
+            values = dict()
+            for key, strval, intval in \
+                    re.findall(r"(\w+):\s*(?:'([^']*)'|(\d+))", fields):
+                values[key] = int(intval) if intval else strval
+            objects[name] = values
+
+        keys, plain, cipher = objects['Keys'], objects['Plain'], objects['Cipher']
+        vectors.append(benchlib.Object(
+            name   = title.strip(),
+            pv     = int(keys['pv'], 16),
+            alg    = keys['alg'],
+            keys   = dict((k, v if isinstance(v, int) else _unhex(v)) \
+                              for k, v in keys.items() if k not in ('pv', 'alg')),
+            type   = int(plain['type'], 16),
+            plain  = _unhex(plain['fragment']),
+            cipher = _unhex(cipher['fragment']),
+        ))
+
+    return vectors
+
+# --------------------------------------------------------------------
+def _header(sn, ctype, pv, length):
+    return struct.pack('>QBHH', sn, ctype, pv, length)
+
+def _pad(data, blksz = 16):
+    padlen = blksz - 1 - len(data) % blksz
+    return data + struct.pack('B', padlen) * (padlen + 1)
+
+# --------------------------------------------------------------------
+class CryptographyBackend(object):
+    name = 'cryptography'
+
+    def __init__(self):
+        from cryptography.hazmat.primitives.ciphers import aead, Cipher, algorithms, modes
+        from cryptography.hazmat.backends import default_backend
+        self._aead    = aead
+        self._cipher  = (Cipher, algorithms, modes, default_backend())
+
+    def _aead_of(self, alg, key):
+        if alg.startswith('AES_'):
+            return self._aead.AESGCM(key)
+        return self._aead.ChaCha20Poly1305(key)
+
+    def _cbc(self, key, iv):
+        Cipher, algorithms, modes, backend = self._cipher
+        return Cipher(algorithms.AES(key), modes.CBC(iv), backend = backend)
+
+    # TLS 1.2 AES-GCM: nonce = salt || explicit, sent in the clear
+    def tls12_gcm(self, key, salt):
+        aead = self._aead_of('AES_128_GCM', key)
+
+        def seal(sn, ctype, pv, plain, explicit = b'\0' * 8):
+            ad = _header(sn, ctype, pv, len(plain))
+            return explicit + aead.encrypt(salt + explicit, plain, ad)
+
+        def open(sn, ctype, pv, cipher):
+            explicit, cipher = cipher[:8], cipher[8:]
+            ad = _header(sn, ctype, pv, len(cipher) - TAGLEN)
+            return aead.decrypt(salt + explicit, cipher, ad)
+
+        return (seal, open)
+
+    # MAC-then-encrypt AES-CBC with HMAC-SHA1. From TLS 1.1 on, the IV
+    # is explicit; in TLS 1.0, it is chained from the previous record
+    # (here always [iv]).
+    def tls_cbc(self, mackey, enckey, iv, explicit):
+        def seal(sn, ctype, pv, plain):
+            mac  = hmac.new(mackey, _header(sn, ctype, pv, len(plain)) + plain, hashlib.sha1)
+            data = _pad(plain + mac.digest())
+            enc  = self._cbc(enckey, iv).encryptor()
+            data = enc.update(data) + enc.finalize()
+            return iv + data if explicit else data
+
+        def open(sn, ctype, pv, cipher):
+            civ, cipher = (cipher[:16], cipher[16:]) if explicit else (iv, cipher)
+            dec   = self._cbc(enckey, civ).decryptor()
+            data  = dec.update(cipher) + dec.finalize()
+            data  = data[:-(ord(data[-1:]) + 1)]
+            plain = data[:-20]
+            mac   = hmac.new(mackey, _header(sn, ctype, pv, len(plain)) + plain, hashlib.sha1)
+            if not hmac.compare_digest(mac.digest(), data[-20:]):
+                raise ValueError('bad record MAC')
+            return plain
+
+        return (seal, open)
+
+    # TLS 1.3 AEAD: nonce = iv ^ seqn, additional data = record header
+    def tls13_aead(self, alg, key, iv):
+        aead = self._aead_of(alg, key)
+
+        def nonce(sn):
+            return iv[:4] + struct.pack('>Q', struct.unpack('>Q', iv[4:])[0] ^ sn)
+
+        def seal(sn, ctype, pv, plain):
+            ad = struct.pack('>BHH', 0x17, 0x0303, len(plain) + 1 + TAGLEN)
+            return aead.encrypt(nonce(sn), plain + struct.pack('B', ctype), ad)
+
+        def open(sn, ctype, pv, cipher):
+            ad = struct.pack('>BHH', 0x17, 0x0303, len(cipher))
+            return aead.decrypt(nonce(sn), cipher, ad)[:-1]
+
+        return (seal, open)
+
+# --------------------------------------------------------------------
+class QuicCryptoBackend(object):
+    """
+    miTLS' quic_crypto_* AEAD API (libquiccrypto, see apps/quicMinusNet).
+    The library is looked up as $QUICCRYPTO, then in the library path.
+    """
+    name = 'quiccrypto'
+
+    def __init__(self):
+        lib = ctypes.CDLL(os.environ.get('QUICCRYPTO', 'libquiccrypto.so'))
+
+        lib.quic_crypto_create.argtypes = \
+            [ctypes.POINTER(ctypes.c_void_p), ctypes.c_int,
+             ctypes.c_char_p, ctypes.c_char_p, ctypes.c_char_p]
+        for fn in (lib.quic_crypto_encrypt, lib.quic_crypto_decrypt):
+            fn.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_uint64,
+                           ctypes.c_char_p, ctypes.c_uint32,
+                           ctypes.c_char_p, ctypes.c_uint32]
+        lib.quic_crypto_free_key.argtypes = [ctypes.c_void_p]
+
+        self._lib  = lib
+        self._keys = []
+
+    def __del__(self):
+        for key in getattr(self, '_keys', []):
+            self._lib.quic_crypto_free_key(key)
+
+    def tls12_gcm(self, key, salt):
+        return None
+
+    def tls_cbc(self, mackey, enckey, iv, explicit):
+        return None
+
+    def tls13_aead(self, alg, key, iv):
+        lib    = self._lib
+        handle = ctypes.c_void_p()
+        pnekey = b'\0' * 32
+
+        if not lib.quic_crypto_create(ctypes.byref(handle), AEADS.index(alg), key, iv, pnekey):
+            raise RuntimeError('quic_crypto_create(%s) failed' % (alg,))
+        self._keys.append(handle)
+
+        buffers = dict()
+        def buffer(size):
+            if size not in buffers:
+                buffers[size] = ctypes.create_string_buffer(size)
+            return buffers[size]
+
+        def seal(sn, ctype, pv, plain):
+            plain = plain + struct.pack('B', ctype)
+            ad    = struct.pack('>BHH', 0x17, 0x0303, len(plain) + TAGLEN)
+            out   = buffer(len(plain) + TAGLEN)
+            if not lib.quic_crypto_encrypt(handle, out, sn, ad, len(ad), plain, len(plain)):
+                raise RuntimeError('quic_crypto_encrypt failed')
+            return out.raw
+
+        def open(sn, ctype, pv, cipher):
+            ad  = struct.pack('>BHH', 0x17, 0x0303, len(cipher))
+            out = buffer(len(cipher) - TAGLEN)
+            if not lib.quic_crypto_decrypt(handle, out, sn, ad, len(ad), cipher, len(cipher)):
+                raise ValueError('quic_crypto_decrypt failed')
+            return out.raw[:-1]
+
+        return (seal, open)
+
+# --------------------------------------------------------------------
+BACKENDS = dict(cryptography = CryptographyBackend, quiccrypto = QuicCryptoBackend)
+
+def backends(names):
+    """Instantiate the backends [names], skipping the unavailable ones"""
+    available = []
+    for name in names:
+        try:
+            available.append(BACKENDS[name]())
+        except (ImportError, OSError, AttributeError) as e:
+            print('# backend %s unavailable: %s' % (name, e), file = sys.stderr)
+    return available
+
+# --------------------------------------------------------------------
+def fixtures(backend, vectors):
+    """
+    Record protections of [backend] as (name, alg, pv, seal, open,
+    vector) tuples. Protections built from a vector are checked against
+    it first; [vector] is None for the synthetic TLS 1.3 ones.
+    """
+    result = []
+
+    for vector in vectors:
+        keys = vector.keys
+        if 'GCM' in vector.alg:
+            prot = backend.tls12_gcm(keys['writeKey'], keys['writeIv'])
+        else:
+            prot = backend.tls_cbc(keys['writeMacKey'], keys['writeKey'],
+                                   keys['writeIv'], vector.pv >= 0x0302)
+        if prot is None:
+            continue
+
+        seal, open = prot
+        sn = keys['writeSn']
+        if seal(sn, vector.type, vector.pv, vector.plain) != vector.cipher:
+            raise AssertionError('%s: %s does not match the vector' % (backend.name, vector.name))
+        if open(sn, vector.type, vector.pv, vector.cipher) != vector.plain:
+            raise AssertionError('%s: %s does not decrypt the vector' % (backend.name, vector.name))
+
+        result.append((vector.name, vector.alg, vector.pv, seal, open, vector))
+
+    for alg in AEADS:
+        key = hashlib.sha256(alg.encode('ascii')).digest()[:KEYLEN[alg]]
+        iv  = hashlib.sha256(b'iv' + alg.encode('ascii')).digest()[:12]
+        seal, open = backend.tls13_aead(alg, key, iv)
+        result.append(('TLS 1.3 AEAD', alg, 0x0304, seal, open, None))
+
+    return result
+
+# --------------------------------------------------------------------
+def measure(fn, nbytes, duration = DURATION):
+    """Throughput (MiB/s) of [fn], processing [nbytes] per call"""
+    count, start = 0, time.time()
+    while True:
+        for _ in range(16):
+            fn()
+        count += 16
+        elapsed = time.time() - start
+        if elapsed >= duration:
+            return count * nbytes / (1024. * 1024.) / elapsed
+
+# --------------------------------------------------------------------
+def _options():
+    from optparse import OptionParser
+
+    parser = OptionParser(usage = '%prog [options]')
+
+    parser.add_option("-b", None,
+                      action  = "append",
+                      dest    = "backends",
+                      help    = "backend to benchmark (repeatable, default: all) [%s]" % \
+                                    ('|'.join(sorted(BACKENDS.keys())),),
+                      metavar = "BACKEND",
+                      choices = sorted(BACKENDS.keys()),
+                      default = [])
+    parser.add_option("-s", None,
+                      dest    = "sizes",
+                      help    = "comma-separated fragment sizes [%s]" % \
+                                    (','.join(map(str, SIZES)),),
+                      metavar = "SIZES",
+                      default = None)
+    parser.add_option("-t", None,
+                      dest    = "duration",
+                      help    = "seconds per measurement [%default]",
+                      metavar = "SECS",
+                      type    = float,
+                      default = DURATION)
+    parser.add_option("-V", None,
+                      dest    = "vectors",
+                      help    = "test vectors file [src/tls/record-testvectors.txt]",
+                      metavar = "FILE",
+                      default = VECTORS)
+    parser.add_option("-n", None,
+                      action  = "store_true",
+                      dest    = "checkonly",
+                      help    = "only check the backends against the vectors",
+                      default = False)
+    parser.add_option("-o", None,
+                      dest    = "output",
+                      help    = "write structured results to OUTPUT (JSON)",
+                      metavar = "OUTPUT",
+                      default = None)
+
+    (options, args) = parser.parse_args()
+
+    if args:
+        parser.error('no positional arguments expected')
+
+    try:
+        sizes = SIZES if options.sizes is None else options.sizes.split(',')
+        options.sizes = [int(x) for x in sizes]
+    except ValueError:
+        parser.error('invalid fragment sizes: %s' % (options.sizes,))
+
+    options.backends = options.backends or sorted(BACKENDS.keys())
+
+    return options
+
+# --------------------------------------------------------------------
+def _main():
+    options = _options()
+    vectors = load_vectors(options.vectors)
+    store   = benchlib.ResultStore(options.output,
+                  vectors = options.vectors, duration = options.duration)
+    found   = backends(options.backends)
+
+    if not found:
+        print('no backend available', file = sys.stderr)
+        exit(1)
+
+    for backend in found:
+        protections = fixtures(backend, vectors)
+        print('# %s: %d vector(s) checked' % \
+                  (backend.name, len([x for x in protections if x[5] is not None])),
+              file = sys.stderr)
+        if options.checkonly:
+            continue
+
+        for name, alg, pv, seal, open, _ in protections:
+            for size in options.sizes:
+                plain  = os.urandom(size)
+                cipher = seal(1, 0x17, pv, plain)
+                rates  = dict(
+                    encrypt = measure(lambda : seal(1, 0x17, pv, plain), size, options.duration),
+                    decrypt = measure(lambda : open(1, 0x17, pv, cipher), size, options.duration),
+                )
+                for op in ('encrypt', 'decrypt'):
+                    print('%s/%s/%s/%d/%s: %.2f MiB/s' % \
+                              (backend.name, name.replace(' ', ''), alg, size, op, rates[op]))
+                sys.stdout.flush()
+
+                store.add(matrix = 'record', backend = backend.name,
+                          cipher = alg, version = name, payload = size,
+                          results = dict((op, dict(rate = v)) for op, v in rates.items()))
+
+    store.save()
+
+# --------------------------------------------------------------------
+if __name__ == '__main__':
+    _main()
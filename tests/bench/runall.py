@@ -1,7 +1,8 @@
 #! /usr/bin/env python
 
 # --------------------------------------------------------------------
-import sys, os, subprocess as sp
+import sys, os, time, threading, Queue as queue, subprocess as sp
+import benchlib, profiling
 
 # --------------------------------------------------------------------
 # BIN = './openssl-client.exe'
@@ -9,41 +10,315 @@ import sys, os, subprocess as sp
 BIN = '../../BenchClient/bin/Release/BenchClient.exe'
 # BIN = 'bc/BCClient/bin/Release/BCClient.exe'
 
-CONFIGS = [
-    ('rsa', 'rsa.cert-01.mitls.org', 'TLS_RSA_WITH_RC4_128_MD5'           ),
-    ('rsa', 'rsa.cert-01.mitls.org', 'TLS_RSA_WITH_RC4_128_SHA'           ),
-    ('rsa', 'rsa.cert-01.mitls.org', 'TLS_RSA_WITH_3DES_EDE_CBC_SHA'      ),
-    ('rsa', 'rsa.cert-01.mitls.org', 'TLS_RSA_WITH_AES_128_CBC_SHA'       ),
-    ('rsa', 'rsa.cert-01.mitls.org', 'TLS_RSA_WITH_AES_128_CBC_SHA256'    ),
-    ('rsa', 'rsa.cert-01.mitls.org', 'TLS_RSA_WITH_AES_256_CBC_SHA'       ),
-    ('rsa', 'rsa.cert-01.mitls.org', 'TLS_RSA_WITH_AES_256_CBC_SHA256'    ),
-    ('dsa', 'dsa.cert-01.mitls.org', 'TLS_DHE_DSS_WITH_3DES_EDE_CBC_SHA'  ),
-    ('dsa', 'dsa.cert-01.mitls.org', 'TLS_DHE_DSS_WITH_AES_128_CBC_SHA'   ),
-    ('dsa', 'dsa.cert-01.mitls.org', 'TLS_DHE_DSS_WITH_AES_128_CBC_SHA256'),
-    ('dsa', 'dsa.cert-01.mitls.org', 'TLS_DHE_DSS_WITH_AES_256_CBC_SHA'   ),
-    ('dsa', 'dsa.cert-01.mitls.org', 'TLS_DHE_DSS_WITH_AES_256_CBC_SHA256'),
-]
+LOADGEN = 'python loadgen.py'
+
+PORT = 5000
+
+MATRICES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'runall.ini')
 
 # --------------------------------------------------------------------
-def _main():
-    configs = CONFIGS[:]
+def _options():
+    from optparse import OptionParser
+
+    parser = OptionParser(usage = '%prog [options]')
+
+    parser.add_option("-C", None,
+                      dest    = "matrixfile",
+                      help    = "read the config matrices from FILE [runall.ini]",
+                      metavar = "FILE",
+                      default = MATRICES)
+    parser.add_option("-m", None,
+                      action  = "append",
+                      dest    = "matrices",
+                      help    = "run matrix NAME (repeatable, default: [config].matrices)",
+                      metavar = "NAME",
+                      default = [])
+    parser.add_option("-f", None,
+                      action  = "append",
+                      dest    = "includes",
+                      help    = "only run the configs matching EXPR (repeatable)",
+                      metavar = "EXPR",
+                      default = [])
+    parser.add_option("-x", None,
+                      action  = "append",
+                      dest    = "excludes",
+                      help    = "do not run the configs matching EXPR (repeatable)",
+                      metavar = "EXPR",
+                      default = [])
+    parser.add_option("-n", None,
+                      action  = "store_true",
+                      dest    = "dryrun",
+                      help    = "print the expanded plan and exit",
+                      default = False)
+    parser.add_option("-c", None,
+                      dest    = "client",
+                      help    = "client command [%s]" % (BIN,),
+                      metavar = "CLIENT",
+                      default = None)
+    parser.add_option("-s", None,
+                      dest    = "server",
+                      help    = "server command, started for each config",
+                      metavar = "SERVER",
+                      default = None)
+    parser.add_option("-j", None,
+                      dest    = "jobs",
+                      help    = "run up to JOBS configs in parallel (implies -p)",
+                      metavar = "JOBS",
+                      type    = int,
+                      default = 1)
+    parser.add_option("-p", None,
+                      action  = "store_true",
+                      dest    = "pin",
+                      help    = "pin server & client to disjoint CPU sets",
+                      default = False)
+    parser.add_option("-w", None,
+                      dest    = "width",
+                      help    = "number of CPUs per pinned process [%default]",
+                      metavar = "WIDTH",
+                      type    = int,
+                      default = 1)
+    parser.add_option("-P", None,
+                      dest    = "port",
+                      help    = "base TCP port [%default]",
+                      metavar = "PORT",
+                      type    = int,
+                      default = PORT)
+    parser.add_option("-l", None,
+                      action  = "store_true",
+                      dest    = "latency",
+                      help    = "collect per-handshake latency histograms",
+                      default = False)
+    parser.add_option("-L", None,
+                      dest    = "load",
+                      help    = "run the load profile PROFILE (see loadgen.py)",
+                      metavar = "PROFILE",
+                      default = None)
+    parser.add_option("", "--profile",
+                      dest    = "profile",
+                      help    = "profile the client with KIND (%s)" % ('|'.join(profiling.KINDS),),
+                      metavar = "KIND",
+                      choices = profiling.KINDS,
+                      default = None)
+    parser.add_option("-o", None,
+                      dest    = "output",
+                      help    = "write structured results to OUTPUT (JSON)",
+                      metavar = "OUTPUT",
+                      default = None)
+
+    (options, args) = parser.parse_args()
+
+    if args:
+        parser.error('no positional arguments expected')
+    if options.jobs < 1 or options.width < 1:
+        parser.error('JOBS and WIDTH must be positive')
+    if options.jobs > 1:
+        if options.server is None:
+            parser.error('parallel runs (-j) need a server command (-s)')
+        options.pin = True
+    if options.client is None:
+        options.client = BIN if options.load is None else LOADGEN
+    if options.profile is not None:
+        if options.output is None:
+            options.profdir = 'profiles'
+        else:
+            options.profdir = os.path.splitext(options.output)[0] + '.profiles'
+
+    return options
+
+# --------------------------------------------------------------------
+def _configs(options):
+    configs = benchlib.load_matrices(options.matrixfile, options.matrices or None)
+    configs = benchlib.ConfigFilter(options.includes, options.excludes).filter(configs)
 
     mode = os.environ.get('MODE', None)
     if mode is not None:
-        cfilt = [x for x in mode.split(':') if x]
-        for filt in cfilt:
-            if filt.startswith('!'):
-                configs = [x for x in configs if filt[1:] not in x[2]]
-            else:
-                configs = [x for x in configs if filt in x[2]]
+        configs = benchlib.ConfigFilter.of_mode(mode).filter(configs)
+
+    return configs
+
+# --------------------------------------------------------------------
+def _print_plan(configs, stream = sys.stderr):
+    print >>stream, '# %d config(s) to run' % (len(configs),)
+    for i, config in enumerate(configs):
+        print >>stream, '%3d. %-10s %-4s %-24s %-38s %-8s %s' % \
+            (i+1, config.matrix, config.pki, config.certname,
+             config.cipher, config.version,
+             '-' if config.payload is None else config.payload)
+
+# --------------------------------------------------------------------
+def _slots(options):
+    if not options.pin:
+        return [benchlib.Object(port = options.port, server = None, client = None)]
+
+    slots = benchlib.cpu_slots(options.jobs, options.width)
+    slots = [benchlib.Object(port = options.port + i, server = x[0], client = x[1]) \
+                 for i, x in enumerate(slots)]
+    return slots
+
+# --------------------------------------------------------------------
+def _run_config(config, slot, options):
+    environ = os.environ.copy()
+    environ['PKI']         = '../pki/%s' % (config.pki,)
+    environ['CERTNAME']    = config.certname
+    environ['CIPHERSUITE'] = config.cipher
+    environ['TLSVERSION']  = config.version
+    environ['PORT']        = str(slot.port)
+
+    if config.payload is not None:
+        environ['PAYLOAD'] = str(config.payload)
+
+    if options.latency:
+        environ['HSTIMES'] = '1'
+    if options.load is not None:
+        environ['LOADPROFILE'] = options.load
+
+    server = None
+    usage  = dict(client = None, server = None)
+
+    if options.server is not None:
+        command, preexec = benchlib.pinned(options.server, slot.server)
+        server  = sp.Popen('exec ' + command, env = environ, shell = True,
+                           preexec_fn = preexec)
+        ssample = benchlib.ProcSampler(server.pid)
+        ssample.start()
+
+    try:
+        if server is not None:
+            benchlib.wait_for_port(slot.port, process = server)
+
+        command = options.client
+        if options.profile is not None:
+            kind    = options.profile
+            kind    = profiling.kind_of_command(command) if kind == 'auto' else kind
+            profile = '-'.join([str(x) for x in \
+                          (config.matrix, config.pki, config.certname,
+                           config.cipher, config.version, config.payload)])
+            profile = os.path.join(options.profdir, profile)
+            command = profiling.wrap(kind, command, profile)
+
+        command, preexec = benchlib.pinned(command, slot.client)
+        start   = time.time()
+        client  = sp.Popen('exec ' + command, env = environ, shell = True,
+                           stdout = sp.PIPE, preexec_fn = preexec)
+        csample = benchlib.ProcSampler(client.pid)
+        csample.start()
+        output  = client.stdout.read()
+        usage['client'] = benchlib.wait_rusage(client)
+        usage['client'].update(csample.stop())
+        wall    = time.time() - start
+        if client.returncode != 0:
+            raise sp.CalledProcessError(client.returncode, command)
+    finally:
+        if server is not None:
+            rss = ssample.stop()
+            if server.poll() is None:
+                server.terminate()
+                usage['server'] = benchlib.wait_rusage(server)
+                usage['server'].update(rss)
+
+    artifacts = None
+    if options.profile is not None:
+        artifacts = profiling.collect(kind, profile, config.cipher)
+        artifacts['kind'] = kind
+
+    results = benchlib.parse_client_output(output)
+    results = benchlib.summarize_latencies(results)
+    results = benchlib.summarize_load(results)
+    results = benchlib.efficiency(results, usage)
+
+    return (output, dict(
+        matrix      = config.matrix,
+        pki         = config.pki,
+        certname    = config.certname,
+        cipher      = config.cipher,
+        version     = config.version,
+        payload     = config.payload,
+        port        = slot.port,
+        server_cpus = slot.server,
+        client_cpus = slot.client,
+        wall        = wall,
+        usage       = usage,
+        profile     = artifacts,
+        results     = results,
+    ))
+
+# --------------------------------------------------------------------
+def _run_all(configs, slots, options, store):
+    jobs   = queue.Queue()
+    lock   = threading.Lock()
+    errors = []
 
     for config in configs:
-        environ = os.environ.copy()
-        environ['PKI']         = '../pki/%s' % (config[0],)
-        environ['CERTNAME']    = config[1]
-        environ['CIPHERSUITE'] = config[2]
+        jobs.put(config)
+
+    def worker(slot):
+        while not errors:
+            try:
+                config = jobs.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                output, record = _run_config(config, slot, options)
+            except Exception as e:
+                with lock:
+                    errors.append((config, e))
+                return
+            with lock:
+                sys.stdout.write(output)
+                sys.stdout.flush()
+                store.add(**record)
+
+    threads = [threading.Thread(target = worker, args = (x,)) for x in slots]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return errors
+
+# --------------------------------------------------------------------
+def _main():
+    options = _options()
+
+    try:
+        configs = _configs(options)
+    except ValueError as e:
+        print >>sys.stderr, 'invalid configs: %s' % (e,)
+        exit(1)
+
+    _print_plan(configs)
+    if options.dryrun:
+        exit(0)
+
+    try:
+        slots = _slots(options)
+    except ValueError as e:
+        print >>sys.stderr, 'cannot pin processes: %s' % (e,)
+        exit(1)
+
+    store = benchlib.ResultStore(options.output,
+        client  = options.client,
+        server  = options.server,
+        jobs    = len(slots),
+        pinned  = options.pin,
+        latency = options.latency,
+        load    = options.load,
+        profile = options.profile,
+        slots   = [x.__dict__ for x in slots])
+
+    if options.profile is not None and not os.path.isdir(options.profdir):
+        os.makedirs(options.profdir)
+
+    start  = time.time()
+    errors = _run_all(configs, slots, options, store)
+
+    store.add_meta(wall = time.time() - start)
+    store.save()
 
-        sp.check_call(BIN, env = environ, shell = True)
+    for config, e in errors:
+        print >>sys.stderr, '%s: %s' % (config.cipher, e)
+    if errors:
+        exit(1)
 
 # --------------------------------------------------------------------
 if __name__ == '__main__':
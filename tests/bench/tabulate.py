@@ -1,7 +1,8 @@
 #! /usr/bin/env python
 
 # --------------------------------------------------------------------
-import sys, os, re
+import sys, os
+import benchlib
 
 # --------------------------------------------------------------------
 CIPHERS = [
@@ -21,6 +22,24 @@ CIPHERS = [
 
 NAMES = ('mitls-bc', 'mitls-ossl', 'openssl', 'oracle-jsse-1.7')
 
+# --------------------------------------------------------------------
+def _load(server, client):
+    """Results of [client], from its JSON record if any, else from its log"""
+    base = os.path.join('results', server, client)
+
+    if os.path.exists(base + '.json'):
+        result = dict()
+        for record in benchlib.load_results(base + '.json')['results']:
+            result.update(record['results'])
+        return result
+
+    if os.path.exists(base + '.txt'):
+        with open(base + '.txt', 'rb') as stream:
+            contents = stream.read()
+        return benchlib.summarize_latencies(benchlib.parse_client_output(contents))
+
+    return dict()
+
 # --------------------------------------------------------------------
 def _main():
     if len(sys.argv)-1 not in (1, 2):
@@ -40,25 +59,7 @@ def _main():
             clients = [x for x in clients if x in clfilter]
         del clfilter
 
-    contents = [os.path.join('results', server, x + '.txt') for x in clients]
-    contents = [(x, open(x, 'rb').read().splitlines()) for x in contents]
-
-    result = dict()
-
-    for name, content in contents:
-        name = os.path.splitext(os.path.basename(name))[0]
-        for line in content:
-            line = re.sub('#.*$', '', line)
-            m1   = re.search('^(.*?): ((:?\d|\.)+) HS/s$' , line)
-            m2   = re.search('^(.*?): ((:?\d|\.)+) MiB/s$', line)
-
-            if m1 is not None:
-                result.setdefault(name, {}).setdefault(m1.group(1), {})['HS'] = \
-                    float(m1.group(2))
-
-            if m2 is not None:
-                result.setdefault(name, {}).setdefault(m2.group(1), {})['rate'] = \
-                    float(m2.group(2))
+    result = dict((x, _load(server, x)) for x in clients)
 
     print '%% Server  : %s' % (server,)
     print '%% Clients : %s' % (', '.join(clients),)
@@ -71,6 +72,25 @@ def _main():
             columns.append(' - ' if bw is None else '%.2f' % (bw,))
         print ' & '.join(columns) + '\\\\'
 
+    latencies = [x for x in clients \
+                     if any(['latency' in y for y in result[x].values()])]
+
+    if latencies:
+        print
+        print '%% Handshake latency (ms) : %s' % \
+            (', '.join(['p%g' % (x,) for x in benchlib.PERCENTILES]),)
+        print '%% Clients : %s' % (', '.join(latencies),)
+        for cipher, name in CIPHERS:
+            columns = [(' & '.join(name)).replace('_', '\\_')]
+            for client in latencies:
+                latency = result[client].get(cipher, {}).get('latency', None)
+                if latency is not None:
+                    latency = benchlib.Histogram.restore(latency)
+                for p in benchlib.PERCENTILES:
+                    value = None if latency is None else latency.percentile(p)
+                    columns.append(' - ' if value is None else '%.2f' % (value / 1000.,))
+            print ' & '.join(columns) + '\\\\'
+
 # --------------------------------------------------------------------
 if __name__ == '__main__':
     _main()